@@ -8,6 +8,10 @@ echo '===================================================='
 python -m nltk.downloader stopwords book
 cd src/
 echo '===================================================='
+echo 'Build the sentiment model'
+echo '===================================================='
+python -m sentiment.naivebayes
+echo '===================================================='
 echo 'Check for DB changes'
 echo '===================================================='
 python manage.py makemigrations
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import datetime
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -132,3 +133,62 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Entity resolution
+# How long keywords are cached before they are looked up on Wikipedia again
+
+ALIAS_TTL = datetime.timedelta(days=30)
+
+ALIAS_NEGATIVE_TTL = datetime.timedelta(days=1)
+
+
+# Ingestion
+# How often `manage.py ingest` looks for new stories, and the file locked while it does
+
+INGEST_INTERVAL = 15 * 60
+
+INGEST_LOCK = os.path.join(BASE_DIR, 'ingest.lock')
+
+
+# Graph snapshots
+# Number of published versions of the graph kept in the database, number of versions
+# whose changes are kept for clients fetching deltas, how old the latest can
+# get before a request rebuilds it, how long the rebuild is leased for in the cache and
+# how long requests wait for a rebuild when there is no earlier version to send
+
+GRAPH_SNAPSHOTS = 5
+
+GRAPH_CHANGES = 200
+
+GRAPH_MAX_AGE = datetime.timedelta(minutes=30)
+
+GRAPH_REBUILD_LEASE = 60
+
+GRAPH_REBUILD_WAIT = 5
+
+
+# Graph levels of detail
+# Number of nodes sent when only the nodes with the most links are asked for, and how long
+# each level of detail of a version of the graph is cached for
+
+GRAPH_DETAIL_NODES = 200
+
+GRAPH_DETAIL_TIMEOUT = 60 * 60
+
+
+# Graph engine
+# How often each process reads the edges seen since it last looked into its copy of the graph
+
+GRAPH_ENGINE_REFRESH = 60
+
+
+# Graph layout
+# Size of the square the graph is laid out in, and how many steps are taken when laying it
+# out from scratch and when settling it after an update
+
+LAYOUT_SIZE = 1000
+
+LAYOUT_ITERATIONS = 100
+
+LAYOUT_WARM_ITERATIONS = 20
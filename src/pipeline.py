@@ -0,0 +1,184 @@
+"""Runs work through a sequence of stages connected by bounded queues.
+
+Each stage has its own pool of worker threads, so slow network bound stages can
+overlap with CPU and database bound ones. A full queue blocks the stage feeding it,
+which keeps the number of items in flight, and so memory, bounded.
+
+Attributes:
+    DONE (obj): Marker put on a queue once there are no more items for a worker.
+"""
+
+import queue
+import threading
+import time
+
+DONE = object()
+
+
+class Stage(object):
+
+    """A step of a pipeline.
+
+    Attributes:
+        busy (float): Seconds spent by the workers in `func`
+        depth (int): Largest number of items seen waiting on `queue`
+        elapsed (float): Seconds from the start of the run until the stage finished
+        func (function): Called with each item. Its result is passed to the next stage unless it is `None`.
+        items (int): Number of items processed
+        name (str): Name used when reporting on the stage
+        queue (obj): Queue of items waiting to be processed
+        workers (int): Number of worker threads. A stage with no workers must be last and runs in the calling thread.
+    """
+
+    def __init__(self, name, func, workers=1, size=None):
+
+        """Create a stage
+
+        Args:
+            name (str): Name used when reporting on the stage.
+            func (function): Called with each item.
+            workers (int, optional): Number of worker threads.
+            size (int, optional): Maximum number of items waiting for the stage, 0 for no limit. Defaults to twice `workers`.
+        """
+
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=2 * max(workers, 1) if size is None else size)
+        self.items = 0
+        self.busy = 0.0
+        self.depth = 0
+        self.elapsed = 0.0
+        self._finished = 0
+        self._lock = threading.Lock()
+
+    def put(self, item):
+
+        """Queue `item` for the stage, blocking while the queue is full
+
+        Args:
+            item (obj): The item to be processed.
+        """
+
+        self.queue.put(item)
+        self.depth = max(self.depth, self.queue.qsize())
+
+    def process(self, item):
+
+        """Process `item`, timing how long it takes
+
+        Args:
+            item (obj): The item to be processed.
+
+        Returns:
+            obj: The result of `func`
+        """
+
+        start = time.time()
+        try:
+            return self.func(item)
+        finally:
+            with self._lock:
+                self.items += 1
+                self.busy += time.time() - start
+
+    def finish(self):
+
+        """Record that one of the workers has finished
+
+        Returns:
+            bool: Have all of the workers finished?
+        """
+
+        with self._lock:
+            self._finished += 1
+            return self._finished >= self.workers
+
+    def __str__(self):
+
+        """Returns a string when the object is referred to
+
+        Returns:
+            str: Throughput and queue depth of the stage
+        """
+
+        rate = self.items / self.elapsed if self.elapsed > 0 else 0
+        return "{}: {} items in {:.1f}s ({:.1f}/s, {:.1f}s busy), max queue depth {}/{}".format(
+            self.name, self.items, self.elapsed, rate, self.busy, self.depth, self.queue.maxsize)
+
+
+def run(stages, items):
+
+    """Pass each of `items` through `stages`
+
+    The first exception raised by a stage stops the pipeline and is raised once every worker has stopped.
+
+    Args:
+        stages (list): The `Stage`s that the items pass through, in order.
+        items (iterable): The items given to the first stage.
+
+    Returns:
+        list: The results of the last stage that aren't `None`
+    """
+
+    start = time.time()
+    errors = []
+    failed = threading.Event()
+    output = Stage('output', None, size=0)
+    following = stages[1:] + [output]
+
+    def fail(e):
+        errors.append(e)
+        failed.set()
+
+    def feed():
+        try:
+            for item in items:
+                if failed.is_set():
+                    break
+                stages[0].put(item)
+        except Exception as e:
+            fail(e)
+        finally:
+            for i in range(max(stages[0].workers, 1)):
+                stages[0].put(DONE)
+
+    def work(stage, after):
+        while True:
+            item = stage.queue.get()
+            if item is DONE:
+                break
+            # Keep draining after a failure so that nothing upstream blocks
+            if failed.is_set():
+                continue
+            try:
+                result = stage.process(item)
+            except Exception as e:
+                fail(e)
+                continue
+            if result is not None:
+                after.put(result)
+        if stage.finish():
+            stage.elapsed = time.time() - start
+            for i in range(max(after.workers, 1)):
+                after.put(DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for stage, after in zip(stages, following):
+        if stage.workers > 0:
+            threads += [threading.Thread(target=work, args=(stage, after), daemon=True) for i in range(stage.workers)]
+    for thread in threads:
+        thread.start()
+    results = []
+    if stages[-1].workers == 0:
+        work(stages[-1], output)
+    while True:
+        item = output.queue.get()
+        if item is DONE:
+            break
+        results.append(item)
+    for thread in threads:
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return results
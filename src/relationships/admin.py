@@ -1,8 +1,11 @@
 from django.contrib import admin
 
-from .models import Node, Edge, Story, Sentiment
+from .models import Node, Edge, Story, Sentiment, Alias, Snapshot, GraphChange
 
 admin.site.register(Node)
 admin.site.register(Edge)
 admin.site.register(Story)
 admin.site.register(Sentiment)
+admin.site.register(Alias)
+admin.site.register(Snapshot)
+admin.site.register(GraphChange)
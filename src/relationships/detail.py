@@ -0,0 +1,252 @@
+"""Simplified views of the graph for when all of it is too much to show
+
+The graph can be cut down to the nodes with the most links, or each community of closely
+linked nodes can be collapsed into a single node that can then be expanded again. The
+results are cached for each version of the graph.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from . import graph
+import json
+import numpy as np
+
+
+def degrees(full):
+
+    """Returns the total weight of the links of each node
+
+    Args:
+        full (dict): The graph as returned by `graph.build`
+
+    Returns:
+        obj: Array of the weighted degree of each node, in the order of `full['nodes']`
+    """
+
+    index = {node['name']: i for i, node in enumerate(full['nodes'])}
+    ends = [index[link['source']] for link in full['links']] + [index[link['target']] for link in full['links']]
+    weights = [link['weight'] for link in full['links']] * 2
+    return np.bincount(np.asarray(ends, dtype=int), weights=weights, minlength=len(full['nodes']))
+
+
+def subgraph(full, keep):
+
+    """Returns the nodes in `keep` and the links between them
+
+    Args:
+        full (dict): The graph as returned by `graph.build`
+        keep (obj): Indexes of the nodes to be kept
+
+    Returns:
+        dict: The `nodes` and `links` of the subgraph
+    """
+
+    nodes = [full['nodes'][i] for i in keep]
+    names = set(node['name'] for node in nodes)
+    jsonOut = {}
+    jsonOut['links'] = [link for link in full['links'] if link['source'] in names and link['target'] in names]
+    jsonOut['nodes'] = nodes
+
+    return jsonOut
+
+
+def top(full, k):
+
+    """Returns the `k` nodes with the most links and the links between them
+
+    Args:
+        full (dict): The graph as returned by `graph.build`
+        k (int): Number of nodes to keep
+
+    Returns:
+        dict: The `nodes` and `links` of the subgraph
+    """
+
+    order = np.argsort(-degrees(full), kind='mergesort')
+    return subgraph(full, sorted(order[:k]))
+
+
+def communities(full, iterations=20, seed=0):
+
+    """Finds communities of closely linked nodes by label propagation
+
+    Every node starts in its own community and repeatedly joins the community its links
+    weigh most towards. Only a random half of the nodes move in each step, which stops
+    pairs of nodes swapping communities forever.
+
+    Args:
+        full (dict): The graph as returned by `graph.build`
+        iterations (int, optional): Most steps to take
+        seed (int, optional): Seed used to pick the nodes that move in each step
+
+    Returns:
+        obj: Array of the community of each node. Community 0 is the largest.
+    """
+
+    n = len(full['nodes'])
+    index = {node['name']: i for i, node in enumerate(full['nodes'])}
+    origins = np.array([index[link['source']] for link in full['links']], dtype=np.int64)
+    destinations = np.array([index[link['target']] for link in full['links']], dtype=np.int64)
+    weights = np.array([link['weight'] for link in full['links']], dtype=float)
+    nodes = np.concatenate([origins, destinations])
+    neighbours = np.concatenate([destinations, origins])
+    weights = np.concatenate([weights, weights])
+    labels = np.arange(n)
+    random = np.random.RandomState(seed)
+    for step in range(iterations):
+        if len(nodes) == 0:
+            break
+        # Total weight of the links from each node into each neighbouring community
+        pairs, inverse = np.unique(nodes * n + labels[neighbours], return_inverse=True)
+        totals = np.bincount(inverse, weights=weights)
+        node, label = pairs // n, pairs % n
+        # The heaviest community of each node, the lowest label breaking ties
+        order = np.lexsort((label, -totals, node))
+        first = order[np.concatenate([[True], node[order][1:] != node[order][:-1]])]
+        best = labels.copy()
+        best[node[first]] = label[first]
+        if (best == labels).all():
+            break
+        labels = np.where(random.rand(n) < 0.5, best, labels)
+    found, inverse = np.unique(labels, return_inverse=True)
+    rank = np.empty(len(found), dtype=int)
+    rank[np.argsort(-np.bincount(inverse), kind='mergesort')] = np.arange(len(found))
+    return rank[inverse]
+
+
+def collapse(full, labels):
+
+    """Replaces each community with a single node
+
+    Each community is named after its node with the most links and carries its number of
+    members, their average sentiment and average position. Links between communities add up
+    the weights of the links between their members.
+
+    Args:
+        full (dict): The graph as returned by `graph.build`
+        labels (obj): Array of the community of each node, as returned by `communities`
+
+    Returns:
+        dict: The `nodes` and `links` of the collapsed graph
+    """
+
+    labels = np.asarray(labels, dtype=int)
+    count = labels.max() + 1 if len(labels) > 0 else 0
+    members = np.bincount(labels, minlength=count)
+    sentiment = np.bincount(labels, weights=[node['sentiment'] for node in full['nodes']], minlength=count)
+    positions = np.array([[np.nan if node.get(axis) is None else node[axis] for axis in ('x', 'y')]
+                          for node in full['nodes']], dtype=float).reshape(-1, 2)
+    placed = ~np.isnan(positions).any(axis=1)
+    laidOut = np.bincount(labels[placed], minlength=count)
+    x = np.bincount(labels[placed], weights=positions[placed, 0], minlength=count)
+    y = np.bincount(labels[placed], weights=positions[placed, 1], minlength=count)
+    # The member with the most links comes first
+    leaders = {}
+    for i in np.argsort(-degrees(full), kind='mergesort'):
+        leaders.setdefault(labels[i], i)
+    names = []
+    nodeList = []
+    for c in range(count):
+        name = full['nodes'][leaders[c]]['name']
+        name = name if members[c] == 1 else name + ' and ' + str(members[c] - 1) + ' more'
+        names.append(name)
+        toAdd = {}
+        toAdd['name'] = name
+        toAdd['community'] = c
+        toAdd['members'] = int(members[c])
+        toAdd['sentiment'] = float(sentiment[c] / members[c])
+        toAdd['x'] = float(x[c] / laidOut[c]) if laidOut[c] > 0 else None
+        toAdd['y'] = float(y[c] / laidOut[c]) if laidOut[c] > 0 else None
+        nodeList.append(toAdd)
+    index = {node['name']: i for i, node in enumerate(full['nodes'])}
+    weights = {}
+    for link in full['links']:
+        ends = sorted((labels[index[link['source']]], labels[index[link['target']]]))
+        if ends[0] != ends[1]:
+            weights[tuple(ends)] = weights.get(tuple(ends), 0) + link['weight']
+    edgeList = []
+    for (origin, destination), weight in sorted(weights.items()):
+        toAdd = {}
+        toAdd['source'] = names[origin]
+        toAdd['target'] = names[destination]
+        toAdd['origin'] = ''
+        toAdd['weight'] = weight
+        edgeList.append(toAdd)
+    jsonOut = {}
+    jsonOut['links'] = edgeList
+    jsonOut['nodes'] = nodeList
+
+    return jsonOut
+
+
+def members(full, labels, community):
+
+    """Returns the members of a community and the links between them
+
+    Args:
+        full (dict): The graph as returned by `graph.build`
+        labels (obj): Array of the community of each node, as returned by `communities`
+        community (int): The community to expand
+
+    Returns:
+        dict: The `nodes` and `links` of the community
+
+    Raises:
+        LookupError: There is no such community
+    """
+
+    keep = np.flatnonzero(np.asarray(labels) == community)
+    if len(keep) == 0:
+        raise LookupError('There is no community ' + str(community))
+    return subgraph(full, keep)
+
+
+def build(snapshot, lod, value=None):
+
+    """Builds a level of detail of the graph in a snapshot
+
+    Args:
+        snapshot (obj): The `Snapshot` of the graph
+        lod (str): `top` for the `value` nodes with the most links, `communities` for the graph
+            with its communities collapsed, or `community` for the members of community `value`
+        value (int, optional): The number of nodes or the community
+
+    Returns:
+        dict: The graph at that level of detail
+    """
+
+    full = json.loads(graph.payload(snapshot).decode('utf-8'))
+    if lod == 'top':
+        jsonOut = top(full, value)
+    else:
+        # Shared by the collapsed graph and every community in it
+        labels = cache.get_or_set('relationships.detail.' + snapshot.etag + '.communities',
+                                  lambda: communities(full).tolist(), settings.GRAPH_DETAIL_TIMEOUT)
+        jsonOut = collapse(full, labels) if lod == 'communities' else members(full, labels, value)
+    jsonOut['version'] = snapshot.version()
+
+    return jsonOut
+
+
+def payload(snapshot, lod, value=None, compact=False, gzipped=False):
+
+    """Returns a level of detail of the graph in a snapshot as it is sent to clients
+
+    Args:
+        snapshot (obj): The `Snapshot` of the graph. Its contents may be deferred.
+        lod (str): The level of detail. See `build`.
+        value (int, optional): The number of nodes or the community. See `build`.
+        compact (bool, optional): Return the graph in the compact format?
+        gzipped (bool, optional): Return the graph compressed with gzip?
+
+    Returns:
+        bytes: The graph
+    """
+
+    def encode():
+        out = build(snapshot, lod, value)
+        content = json.dumps(graph.compactGraph(out) if compact else out).encode('utf-8')
+        return graph.gzipContent(content) if gzipped else content
+
+    key = '.'.join(['relationships.detail', snapshot.etag, lod, str(value),
+                    'compact' if compact else 'json', 'gzip' if gzipped else 'plain'])
+    return cache.get_or_set(key, encode, settings.GRAPH_DETAIL_TIMEOUT)
@@ -0,0 +1,284 @@
+"""Keeps a read optimised copy of the whole graph in memory
+
+The nodes and edges are held as NumPy arrays in compressed sparse row (CSR) form, so the
+neighbours of a node are a slice of one array. Each process loads the graph once and then
+only reads the edges seen since it last looked, which ingestion marks by bumping `lastSeen`.
+
+Attributes:
+    OVERLAP (obj): How far before the latest edge loaded to look again when refreshing, to catch edges
+        whose transactions committed late
+"""
+from django.conf import settings
+from django.utils import timezone
+from .models import Node, Edge
+import datetime
+import threading
+import time
+import numpy as np
+
+OVERLAP = datetime.timedelta(minutes=1)
+
+_engine = None
+_engineLock = threading.Lock()
+
+
+class CSR(object):
+
+    """The graph as arrays. Never changed once built, so it can be read from any thread.
+
+    Each edge is held in both directions. The neighbours of the node at index `i` are
+    `indices[indptr[i]:indptr[i + 1]]`, with the weight and last seen time of each edge at the
+    same positions of `weights` and `seen`.
+
+    Attributes:
+        ids (obj): Array of the ID of the node at each index, in ascending order
+        indices (obj): Array of the indexes of the neighbours of each node
+        indptr (obj): Array of where the neighbours of each node start in `indices`
+        seen (obj): Array of when each edge was last seen, in seconds since the epoch
+        weights (obj): Array of the weight of each edge
+    """
+
+    def __init__(self, ids, origins, destinations, weights, seen):
+
+        """Build the arrays from a list of edges
+
+        Args:
+            ids (obj): Array of the IDs of the nodes, in ascending order
+            origins (obj): Array of the index of the origin of each edge
+            destinations (obj): Array of the index of the destination of each edge
+            weights (obj): Array of the weight of each edge
+            seen (obj): Array of when each edge was last seen
+        """
+
+        rows = np.concatenate([origins, destinations])
+        columns = np.concatenate([destinations, origins])
+        order = np.lexsort((columns, rows))
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(ids)), out=self.indptr[1:])
+        self.indices = columns[order].astype(np.int32)
+        self.weights = np.concatenate([weights, weights])[order].astype(np.uint32)
+        self.seen = np.concatenate([seen, seen])[order].astype(np.float64)
+
+    def edges(self):
+
+        """Returns each edge once, with the origin having the lower index
+
+        Returns:
+            tuple: Arrays of the origins, destinations, weights and last seen times of the edges
+        """
+
+        rows = np.repeat(np.arange(len(self.ids)), np.diff(self.indptr))
+        once = rows < self.indices
+        return rows[once], self.indices[once].astype(np.int64), self.weights[once], self.seen[once]
+
+    def merge(self, ids, origins, destinations, weights, seen):
+
+        """Returns a copy of the graph with nodes and edges added or updated
+
+        Args:
+            ids (obj): Array of the IDs of nodes, which may already be in the graph
+            origins (obj): Array of the node ID of the origin of each edge
+            destinations (obj): Array of the node ID of the destination of each edge
+            weights (obj): Array of the new weight of each edge
+            seen (obj): Array of when each edge was last seen
+
+        Returns:
+            obj: The new `CSR`
+        """
+
+        allIds = np.union1d(self.ids, np.concatenate([ids, origins, destinations]).astype(np.int64))
+        rows, columns, oldWeights, oldSeen = self.edges()
+        rows = np.concatenate([np.searchsorted(allIds, self.ids[rows]), np.searchsorted(allIds, origins)])
+        columns = np.concatenate([np.searchsorted(allIds, self.ids[columns]), np.searchsorted(allIds, destinations)])
+        low, high = np.minimum(rows, columns), np.maximum(rows, columns)
+        # The last occurrence of each edge is the newest
+        unique, first = np.unique((low * len(allIds) + high)[::-1], return_index=True)
+        keep = len(low) - 1 - first
+        return CSR(allIds, low[keep], high[keep], np.concatenate([oldWeights, weights])[keep],
+                   np.concatenate([oldSeen, seen])[keep])
+
+    def __contains__(self, id):
+
+        """Returns whether a node is in the graph
+
+        Args:
+            id (int): The ID of the node
+
+        Returns:
+            bool: Is the node in the graph?
+        """
+
+        i = np.searchsorted(self.ids, id)
+        return bool(i < len(self.ids) and self.ids[i] == id)
+
+    def index(self, id):
+
+        """Returns the index of a node
+
+        Args:
+            id (int): The ID of the node
+
+        Returns:
+            int: The index of the node
+
+        Raises:
+            KeyError: The node isn't in the graph
+        """
+
+        i = np.searchsorted(self.ids, id)
+        if i >= len(self.ids) or self.ids[i] != id:
+            raise KeyError(id)
+        return int(i)
+
+    def neighbours(self, id, since=None):
+
+        """Returns the nodes linked to a node
+
+        Args:
+            id (int): The ID of the node
+            since (float, optional): Only include edges seen at or after this many seconds since the epoch
+
+        Returns:
+            obj: Array of the IDs of the neighbours
+        """
+
+        i = self.index(id)
+        found = self.indices[self.indptr[i]:self.indptr[i + 1]]
+        if since is not None:
+            found = found[self.seen[self.indptr[i]:self.indptr[i + 1]] >= since]
+        return self.ids[found]
+
+    def degree(self, id, weighted=False):
+
+        """Returns the number of links of a node
+
+        Args:
+            id (int): The ID of the node
+            weighted (bool, optional): Add up the weights of the links instead?
+
+        Returns:
+            int: The degree of the node
+        """
+
+        i = self.index(id)
+        if weighted:
+            return int(self.weights[self.indptr[i]:self.indptr[i + 1]].sum())
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def path(self, origin, destination, depth=6):
+
+        """Returns a shortest path between two nodes
+
+        Searches breadth first, a whole layer of nodes at a time.
+
+        Args:
+            origin (int): The ID of the node to start from
+            destination (int): The ID of the node to find
+            depth (int, optional): Most links to follow
+
+        Returns:
+            list: The IDs of the nodes on the path, from `origin` to `destination`. `None` if there isn't one.
+        """
+
+        start, end = self.index(origin), self.index(destination)
+        parent = np.full(len(self.ids), -1, dtype=np.int64)
+        parent[start] = start
+        frontier = np.array([start])
+        for step in range(depth):
+            if parent[end] >= 0 or len(frontier) == 0:
+                break
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            # Positions in `indices` of the neighbours of every node in the frontier
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            found = self.indices[np.repeat(starts, counts) + offsets]
+            owners = np.repeat(frontier, counts)
+            new = parent[found] < 0
+            frontier, first = np.unique(found[new], return_index=True)
+            parent[frontier] = owners[new][first]
+        if parent[end] < 0:
+            return None
+        path = [end]
+        while path[-1] != start:
+            path.append(parent[path[-1]])
+        return [int(self.ids[i]) for i in reversed(path)]
+
+
+class Engine(object):
+
+    """Holds the latest `CSR` of the graph and keeps it up to date with the database
+
+    Attributes:
+        csr (obj): The latest `CSR`
+        cursor (obj): Latest `lastSeen` of the edges loaded, or when the graph was first loaded if there
+            weren't any. `None` before the graph is loaded.
+        refreshed (float): When the graph was last refreshed, in seconds since the epoch
+    """
+
+    def __init__(self):
+
+        """Create an engine with an empty graph
+        """
+
+        empty = np.array([], dtype=np.int64)
+        self.csr = CSR(empty, empty, empty, empty, empty)
+        self.cursor = None
+        self.refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+
+        """Reads the nodes and the edges seen since the last refresh into the graph
+
+        The whole graph is read the first time.
+
+        Returns:
+            obj: The new `CSR`
+        """
+
+        with self._lock:
+            started = timezone.now()
+            edges = Edge.objects.all()
+            nodes = Node.objects.all()
+            if self.cursor is not None:
+                edges = edges.filter(lastSeen__gte=self.cursor - OVERLAP)
+                nodes = nodes.filter(id__gt=self.csr.ids[-1]) if len(self.csr.ids) > 0 else nodes
+            rows = list(edges.values_list('origin_id', 'destination_id', 'weight', 'lastSeen').iterator())
+            ids = np.fromiter(nodes.values_list('id', flat=True).iterator(), dtype=np.int64)
+            origins, destinations, weights, seen = list(zip(*rows)) or [(), (), (), ()]
+            self.csr = self.csr.merge(ids, np.array(origins, dtype=np.int64), np.array(destinations, dtype=np.int64),
+                                      np.array(weights, dtype=np.uint32),
+                                      np.array([date.timestamp() for date in seen], dtype=np.float64))
+            if rows:
+                self.cursor = max(seen) if self.cursor is None else max(self.cursor, max(seen))
+            elif self.cursor is None:
+                # Otherwise every refresh would read the whole graph again until an edge is seen
+                self.cursor = started
+            self.refreshed = time.time()
+            return self.csr
+
+
+def get(age=None, ids=()):
+
+    """Returns the graph held by this process, refreshing it if it is out of date
+
+    Args:
+        age (float, optional): Seconds since the last refresh after which the graph is refreshed.
+            Defaults to `GRAPH_ENGINE_REFRESH`.
+        ids (list, optional): IDs of nodes that are known to exist. The graph is refreshed if any of
+            them were added since it was last refreshed.
+
+    Returns:
+        obj: The latest `CSR`
+    """
+
+    global _engine
+    with _engineLock:
+        if _engine is None:
+            _engine = Engine()
+    age = settings.GRAPH_ENGINE_REFRESH if age is None else age
+    csr = _engine.csr
+    if time.time() - _engine.refreshed >= age or not all(id in csr for id in ids):
+        return _engine.refresh()
+    return csr
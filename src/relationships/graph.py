@@ -0,0 +1,463 @@
+"""Builds the graph sent to clients and publishes it as snapshots
+
+Attributes:
+    COMPACT (str): Media type of the compact format of the graph
+    CHUNK (int): Number of nodes or links serialised at a time when streaming the graph
+    LEASE (str): Cache key held while a snapshot is published
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from .models import Node, Edge, Snapshot, GraphChange, recentSince
+import base64
+import collections
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import threading
+import time
+import zlib
+import numpy as np
+from numpy import interp
+
+COMPACT = 'application/vnd.newsgraph.compact+json'
+
+CHUNK = 1000
+
+LEASE = 'relationships.graph.rebuild'
+
+_rebuilding = threading.Lock()
+
+
+def nodes(since):
+
+    """Yields the nodes of the graph one at a time as they are read from the database
+
+    Args:
+        since (obj): Date after which nodes are recent
+
+    Yields:
+        dict: A node as it is sent to clients
+    """
+
+    # Nodes without any sentiment are shown as slightly positive
+    average = Case(When(sentimentCount__gt=0, then=F('sentimentSum') / F('sentimentCount')),
+                   default=Value(0.6), output_field=FloatField())
+    rows = Node.objects.filter(date__gte=since).annotate(average=average).values_list('name', 'average', 'x', 'y')
+    for name, avg, x, y in rows.iterator():
+        avg = interp(avg, [0, 0.8], [0, 1])
+        toAdd = {}
+        toAdd['name'] = name
+        toAdd['sentiment'] = avg if avg <= 1 else 1
+        toAdd['x'] = x
+        toAdd['y'] = y
+        yield toAdd
+
+
+def links(since):
+
+    """Yields the links between recent nodes one at a time as they are read from the database
+
+    Args:
+        since (obj): Date after which nodes are recent
+
+    Yields:
+        dict: A link as it is sent to clients
+    """
+
+    edges = (Edge.objects.filter(origin__date__gte=since, destination__date__gte=since)
+             .values_list('origin__name', 'destination__name', 'source', 'weight'))
+    for origin, destination, source, weight in edges.iterator():
+        toAdd = {}
+        toAdd['source'] = origin
+        toAdd['target'] = destination
+        toAdd['origin'] = source
+        toAdd['weight'] = weight
+        yield toAdd
+
+
+def build():
+
+    """Builds the graph of recent nodes and the edges between them
+
+    Returns:
+        dict: The `nodes` and `links` of the graph
+    """
+
+    since = recentSince()
+    jsonOut = {}
+    jsonOut['links'] = list(links(since))
+    jsonOut['nodes'] = list(nodes(since))
+
+    return jsonOut
+
+
+def stream(chunk=CHUNK):
+
+    """Serialises the graph as JSON a few items at a time
+
+    Only `chunk` items are held at once, however large the graph is. On PostgreSQL the
+    rows are read through server side cursors too.
+
+    Args:
+        chunk (int, optional): Number of nodes or links in each piece of JSON
+
+    Yields:
+        bytes: The next piece of the JSON
+    """
+
+    since = recentSince()
+    opening = '{'
+    for name, items in (('links', links(since)), ('nodes', nodes(since))):
+        yield (opening + json.dumps(name) + ': [').encode('utf-8')
+        opening = ', '
+        separator = ''
+        for piece in iter(lambda: list(itertools.islice(items, chunk)), []):
+            yield (separator + ', '.join(json.dumps(item) for item in piece)).encode('utf-8')
+            separator = ', '
+        yield b']'
+    yield b'}'
+
+
+def compress(pieces):
+
+    """Compresses a stream of bytes with gzip as it is produced
+
+    Args:
+        pieces (iterable): The bytes to be compressed
+
+    Yields:
+        bytes: The next piece of the compressed stream
+    """
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        # Flushed after each piece so clients receive it straight away
+        yield compressor.compress(piece) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def gzipContent(content):
+
+    """Compresses bytes with gzip, the same way every time
+
+    The header's timestamp is left at 0, so the same content always compresses to the same bytes.
+
+    Args:
+        content (bytes): The bytes to be compressed
+
+    Returns:
+        bytes: The compressed bytes
+    """
+
+    buffer = io.BytesIO()
+    # gzip.compress only takes a timestamp from Python 3.8
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as fp:
+        fp.write(content)
+    return buffer.getvalue()
+
+
+def pack(values, dtype):
+
+    """Packs numbers into little-endian binary, encoded as base64
+
+    Args:
+        values (list): The numbers to be packed
+        dtype (str): NumPy type of each number
+
+    Returns:
+        str: The packed numbers
+    """
+
+    return base64.b64encode(np.asarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+def compactGraph(graph):
+
+    """Converts the graph to the compact format
+
+    Each name and story is sent once, in `names` and `origins`. Links refer to them by their
+    index, and every other number is packed into little-endian binary encoded as base64:
+    `sentiment` holds a float32 for each node and `positions` a pair of float32 that are NaN
+    for nodes that haven't been laid out. `links` holds a pair of uint32 node indexes for each
+    link, then `weights` and `origin` a uint32 each. Graphs with collapsed communities also
+    have `members`, a uint32 for each node.
+
+    Args:
+        graph (dict): The graph as returned by `build`
+
+    Returns:
+        dict: The graph in the compact format
+    """
+
+    names = [node['name'] for node in graph['nodes']]
+    index = {name: i for i, name in enumerate(names)}
+    origins = list(collections.OrderedDict.fromkeys(link['origin'] for link in graph['links']))
+    stories = {origin: i for i, origin in enumerate(origins)}
+    jsonOut = {}
+    jsonOut['version'] = graph.get('version')
+    jsonOut['names'] = names
+    jsonOut['origins'] = origins
+    jsonOut['sentiment'] = pack([node['sentiment'] for node in graph['nodes']], '<f4')
+    jsonOut['positions'] = pack([[node.get('x'), node.get('y')] for node in graph['nodes']], '<f4')
+    jsonOut['links'] = pack([[index[link['source']], index[link['target']]] for link in graph['links']], '<u4')
+    jsonOut['weights'] = pack([link['weight'] for link in graph['links']], '<u4')
+    jsonOut['origin'] = pack([stories[link['origin']] for link in graph['links']], '<u4')
+    if len(graph['nodes']) > 0 and 'members' in graph['nodes'][0]:
+        jsonOut['members'] = pack([node['members'] for node in graph['nodes']], '<u4')
+
+    return jsonOut
+
+
+def key(kind, item):
+
+    """Returns the key that identifies a node or link between versions of the graph
+
+    Args:
+        kind (str): `GraphChange.NODE` or `GraphChange.LINK`
+        item (dict): The node or link as it is sent to clients
+
+    Returns:
+        str: The name of a node, or the names of the nodes at either end of a link
+    """
+
+    return item['name'] if kind == GraphChange.NODE else item['source'] + '\t' + item['target']
+
+
+def diff(old, new):
+
+    """Returns the changes between two versions of the graph
+
+    Args:
+        old (dict): The earlier graph, as returned by `build`
+        new (dict): The later graph
+
+    Returns:
+        list: Unsaved `GraphChange`s without a `version`
+    """
+
+    changes = []
+    for kind, items in ((GraphChange.NODE, 'nodes'), (GraphChange.LINK, 'links')):
+        before = {key(kind, item): item for item in old[items]}
+        after = {key(kind, item): item for item in new[items]}
+        for k, item in after.items():
+            if k not in before:
+                changes.append(GraphChange(kind=kind, action=GraphChange.ADD, key=k, data=json.dumps(item)))
+            elif before[k] != item:
+                changes.append(GraphChange(kind=kind, action=GraphChange.UPDATE, key=k, data=json.dumps(item)))
+        for k, item in before.items():
+            if k not in after:
+                changes.append(GraphChange(kind=kind, action=GraphChange.REMOVE, key=k, data=json.dumps(item)))
+    return changes
+
+
+def publish():
+
+    """Serialises the current graph and stores it as the latest snapshot
+
+    The changes from the previous snapshot are logged under the new version. If there aren't
+    any, the previous snapshot is kept and marked as published now. Only the last
+    `GRAPH_SNAPSHOTS` snapshots and the changes of the last `GRAPH_CHANGES` versions are kept.
+
+    Waits for the lock and lease that `rebuild` takes, so that two snapshots are never
+    diffed against the same previous one.
+
+    Returns:
+        obj: The new `Snapshot`
+    """
+
+    with _rebuilding:
+        while not cache.add(LEASE, True, settings.GRAPH_REBUILD_LEASE):
+            time.sleep(0.05)
+        try:
+            return _publish()
+        finally:
+            cache.delete(LEASE)
+
+
+def _publish():
+
+    """Publishes a snapshot while the caller holds the rebuild lock and lease
+
+    Returns:
+        obj: The new `Snapshot`
+    """
+
+    graph = build()
+    with transaction.atomic():
+        previous = Snapshot.objects.order_by('-id').first()
+        changes = diff(json.loads(bytes(previous.content).decode('utf-8')), graph) if previous else []
+        if previous is not None and len(changes) == 0:
+            previous.date = timezone.now()
+            previous.save(update_fields=['date'])
+            return previous
+        # Saved first so the version can go in the content
+        snapshot = Snapshot.objects.create(content=b'', compressed=b'', etag='')
+        graph['version'] = snapshot.version()
+        snapshot.content = json.dumps(graph).encode('utf-8')
+        snapshot.compact = json.dumps(compactGraph(graph)).encode('utf-8')
+        # mtime is fixed so the same graph always compresses to the same bytes
+        snapshot.compressed = gzipContent(snapshot.content)
+        snapshot.compactCompressed = gzipContent(snapshot.compact)
+        snapshot.etag = hashlib.sha1(snapshot.content).hexdigest()
+        snapshot.save()
+        for change in changes:
+            change.version = snapshot.version()
+        GraphChange.objects.bulk_create(changes)
+        old = Snapshot.objects.order_by('-id').values_list('id', flat=True)[settings.GRAPH_SNAPSHOTS:]
+        Snapshot.objects.filter(id__in=list(old)).delete()
+        GraphChange.objects.filter(version__lte=snapshot.version() - settings.GRAPH_CHANGES).delete()
+    return snapshot
+
+
+def changes(since):
+
+    """Returns the changes to the graph made after version `since`
+
+    Several changes to the same item are combined into one. An item added and then updated
+    counts as added.
+
+    Args:
+        since (int): The version of the graph the client has
+
+    Returns:
+        dict: The `added`, `updated` and `removed` items of the `nodes` and `links`
+    """
+
+    combined = collections.OrderedDict()
+    for change in GraphChange.objects.filter(version__gt=since).order_by('version', 'id'):
+        action = change.action
+        previous = combined.get((change.kind, change.key))
+        if previous is not None and previous[0] == GraphChange.ADD and action == GraphChange.UPDATE:
+            action = GraphChange.ADD
+        combined[(change.kind, change.key)] = (action, change.data)
+    out = {items: {'added': [], 'updated': [], 'removed': []} for items in ('nodes', 'links')}
+    names = {GraphChange.ADD: 'added', GraphChange.UPDATE: 'updated', GraphChange.REMOVE: 'removed'}
+    for (kind, k), (action, data) in combined.items():
+        out['nodes' if kind == GraphChange.NODE else 'links'][names[action]].append(json.loads(data))
+    return out
+
+
+def payload(snapshot, compact=False, gzipped=False):
+
+    """Returns the contents of a snapshot as they are sent to clients
+
+    Args:
+        snapshot (obj): The `Snapshot`. Its contents may be deferred.
+        compact (bool, optional): Return the graph in the compact format?
+        gzipped (bool, optional): Return the graph compressed with gzip?
+
+    Returns:
+        bytes: The graph
+    """
+
+    field = {(False, False): 'content', (False, True): 'compressed',
+             (True, False): 'compact', (True, True): 'compactCompressed'}[(compact, gzipped)]
+    content = bytes(Snapshot.objects.values_list(field, flat=True).get(pk=snapshot.pk))
+    if compact and len(content) == 0:
+        # Published before the compact format existed
+        full = Snapshot.objects.values_list('content', flat=True).get(pk=snapshot.pk)
+        full = json.loads(bytes(full).decode('utf-8'))
+        content = json.dumps(compactGraph(full)).encode('utf-8')
+        content = gzipContent(content) if gzipped else content
+    return content
+
+
+def stale(snapshot):
+
+    """Returns whether `snapshot` is too old to send to clients
+
+    Args:
+        snapshot (obj): The `Snapshot`, or `None` if there isn't one
+
+    Returns:
+        bool: Does the graph need to be rebuilt?
+    """
+
+    return snapshot is None or snapshot.date < timezone.now() - settings.GRAPH_MAX_AGE
+
+
+def current():
+
+    """Returns the most recently published snapshot without its contents
+
+    Returns:
+        obj: The latest `Snapshot` with its contents deferred, or `None` if there isn't one
+    """
+
+    return Snapshot.objects.defer('content', 'compressed', 'compact', 'compactCompressed').order_by('-id').first()
+
+
+def rebuild(previous=None, wait=None):
+
+    """Publishes a new snapshot unless another thread or process is already doing so
+
+    Threads of the same process share a lock and processes share a lease in the cache, so only
+    one rebuild runs at a time. While it does, other callers get `previous`, or if there isn't
+    one, wait up to `wait` seconds for the rebuild to finish before waiting their turn to publish a
+    snapshot themselves.
+
+    Args:
+        previous (obj, optional): The stale `Snapshot` being replaced.
+        wait (float, optional): Seconds to wait for another rebuild. Defaults to `GRAPH_REBUILD_WAIT`.
+
+    Returns:
+        obj: The new `Snapshot`, or `previous` if another rebuild is in progress
+    """
+
+    deadline = time.time() + (settings.GRAPH_REBUILD_WAIT if wait is None else wait)
+    while True:
+        if _rebuilding.acquire(blocking=False):
+            try:
+                if cache.add(LEASE, True, settings.GRAPH_REBUILD_LEASE):
+                    try:
+                        # Another rebuild may have finished since the caller looked
+                        snapshot = current()
+                        return snapshot if not stale(snapshot) else _publish()
+                    finally:
+                        cache.delete(LEASE)
+            finally:
+                _rebuilding.release()
+        if previous is not None:
+            return previous
+        if time.time() >= deadline:
+            return publish()
+        time.sleep(0.05)
+        snapshot = current()
+        if snapshot is not None:
+            return snapshot
+
+
+def version(number):
+
+    """Returns a version of the graph without its contents
+
+    Args:
+        number (int): The version
+
+    Returns:
+        obj: The `Snapshot` with its contents deferred, or `None` if it is no longer kept
+    """
+
+    return Snapshot.objects.defer('content', 'compressed', 'compact', 'compactCompressed').filter(id=number).first()
+
+
+def latest():
+
+    """Returns the latest snapshot of the graph without its contents
+
+    The graph is rebuilt if there isn't a snapshot yet or ingestion hasn't published one in
+    `GRAPH_MAX_AGE`, so that old nodes still drop out of the graph.
+
+    Returns:
+        obj: The latest `Snapshot`. Its contents are deferred.
+    """
+
+    snapshot = current()
+    if stale(snapshot):
+        snapshot = rebuild(snapshot)
+    return snapshot
@@ -0,0 +1,123 @@
+"""Lays out the graph on the server so that clients only have to draw it
+
+Attributes:
+    BLOCK (int): Number of nodes whose repulsion is calculated at once, which bounds memory to `BLOCK` times the number of nodes
+    SAVE_CHUNK (int): Number of nodes whose positions are saved by one query. Each binds 5 SQL variables, and
+        SQLite allows 999.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, FloatField, Value, When
+from .models import Node, Edge, recentSince
+import numpy as np
+
+BLOCK = 256
+SAVE_CHUNK = 150
+
+
+def forceLayout(positions, ends, weights=None, iterations=50, size=1000.0, temperature=None, seed=0):
+
+    """Moves nodes with the Fruchterman-Reingold force directed algorithm
+
+    Every pair of nodes repel each other and the nodes at either end of a link attract each
+    other. How far a node can move starts at `temperature` and falls to nothing over the
+    iterations, so a low temperature only settles nodes around where they already are.
+
+    Args:
+        positions (obj): Array of the x and y of each node. Missing positions are `nan`.
+        ends (obj): Array of the indexes of the nodes at either end of each link
+        weights (obj, optional): Array of the weight of each link
+        iterations (int, optional): Number of steps to take
+        size (float, optional): Width and height of the square the nodes are kept in, centred on the origin
+        temperature (float, optional): Furthest a node can move in the first step. Defaults to a tenth of `size`.
+        seed (int, optional): Seed for placing the nodes without positions
+
+    Returns:
+        obj: Array of the new x and y of each node
+    """
+
+    positions = np.array(positions, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=int).reshape(-1, 2)
+    weights = np.ones(len(ends)) if weights is None else np.asarray(weights, dtype=float)
+    n = len(positions)
+    if n == 0:
+        return positions
+    random = np.random.RandomState(seed)
+    missing = np.isnan(positions).any(axis=1)
+    positions[missing] = random.uniform(-size / 2, size / 2, (missing.sum(), 2))
+    # Nodes on top of each other wouldn't push each other apart
+    positions += random.uniform(-1e-3, 1e-3, positions.shape)
+    k = size / np.sqrt(n)
+    temperature = size / 10 if temperature is None else temperature
+    strength = np.log1p(weights)[:, None]
+    for step in range(iterations):
+        displacement = np.zeros_like(positions)
+        x, y = positions[:, 0], positions[:, 1]
+        for start in range(0, n, BLOCK):
+            dx = x[start:start + BLOCK, None] - x
+            dy = y[start:start + BLOCK, None] - y
+            # Repulsion of k² / distance along the line between each pair
+            factor = dx * dx
+            factor += dy * dy
+            np.maximum(factor, 1e-4, out=factor)
+            np.divide(k * k, factor, out=factor)
+            displacement[start:start + BLOCK, 0] += np.einsum('ij,ij->i', dx, factor)
+            displacement[start:start + BLOCK, 1] += np.einsum('ij,ij->i', dy, factor)
+        delta = positions[ends[:, 0]] - positions[ends[:, 1]]
+        pull = delta * np.sqrt((delta ** 2).sum(axis=1))[:, None] / k * strength
+        np.add.at(displacement, ends[:, 0], -pull)
+        np.add.at(displacement, ends[:, 1], pull)
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-9)
+        limit = temperature * (1 - step / iterations)
+        positions += displacement * (np.minimum(length, limit) / length)[:, None]
+        np.clip(positions, -size / 2, size / 2, out=positions)
+    return positions
+
+
+def update():
+
+    """Lays out the recent nodes and saves their positions
+
+    Nodes keep the positions they had after the previous update, so they only settle a little
+    while new nodes find their place. New nodes start next to the nodes they are linked to.
+    The whole graph is laid out from scratch if most of it is new.
+
+    Returns:
+        int: Number of nodes laid out
+    """
+
+    since = recentSince()
+    rows = list(Node.objects.filter(date__gte=since).values_list('id', 'x', 'y'))
+    index = {row[0]: i for i, row in enumerate(rows)}
+    edges = [(index[origin], index[destination], weight) for origin, destination, weight in
+             Edge.objects.filter(origin__date__gte=since, destination__date__gte=since)
+             .values_list('origin_id', 'destination_id', 'weight')]
+    positions = np.array([(np.nan if x is None else x, np.nan if y is None else y) for i, x, y in rows],
+                         dtype=float).reshape(-1, 2)
+    ends = np.array([edge[:2] for edge in edges], dtype=int).reshape(-1, 2)
+    placed = ~np.isnan(positions).any(axis=1)
+    if placed.sum() > len(rows) / 2:
+        # Start new nodes at the middle of their placed neighbours
+        total = np.zeros_like(positions)
+        count = np.zeros(len(rows))
+        for a, b in ((0, 1), (1, 0)):
+            known = placed[ends[:, b]]
+            np.add.at(total, ends[known, a], positions[ends[known, b]])
+            np.add.at(count, ends[known, a], 1)
+        start = ~placed & (count > 0)
+        positions[start] = total[start] / count[start, None]
+        positions = forceLayout(positions, ends, [edge[2] for edge in edges], settings.LAYOUT_WARM_ITERATIONS,
+                                settings.LAYOUT_SIZE, temperature=settings.LAYOUT_SIZE / 100)
+    else:
+        positions = forceLayout(np.full_like(positions, np.nan), ends, [edge[2] for edge in edges],
+                                settings.LAYOUT_ITERATIONS, settings.LAYOUT_SIZE)
+    ids = [row[0] for row in rows]
+    with transaction.atomic():
+        for start in range(0, len(ids), SAVE_CHUNK):
+            chunk = range(start, min(start + SAVE_CHUNK, len(ids)))
+            Node.objects.filter(id__in=ids[start:start + SAVE_CHUNK]).update(
+                x=Case(*[When(id=ids[i], then=Value(round(float(positions[i, 0]), 1))) for i in chunk],
+                       output_field=FloatField()),
+                y=Case(*[When(id=ids[i], then=Value(round(float(positions[i, 1]), 1))) for i in chunk],
+                       output_field=FloatField()))
+    return len(ids)
@@ -0,0 +1,76 @@
+"""Keeps the database up to date with the news until it is stopped.
+"""
+import signal
+import threading
+import time
+import traceback
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+
+    """Command that ingests new stories on an interval
+
+    The reddit and Wikipedia clients, the sentiment lexicons, the NLP models and the keyword
+    cache are loaded once and kept between runs. SIGTERM and SIGINT let the current run
+    finish before the command exits.
+    """
+
+    help = 'Ingests new stories from reddit every INTERVAL seconds until stopped'
+
+    def add_arguments(self, parser):
+
+        """Add the options of the command
+
+        Args:
+            parser (obj): Parser of the command line arguments
+        """
+
+        parser.add_argument('--interval', type=int, default=settings.INGEST_INTERVAL,
+                            help='Seconds between the start of one run and the next')
+        parser.add_argument('--lock', default=settings.INGEST_LOCK,
+                            help='File locked while a run is in progress')
+        parser.add_argument('--once', action='store_true',
+                            help='Run once and exit')
+        parser.add_argument('--mode', default='top', choices=['top', 'tree', 'sample'],
+                            help='Score stories from their top level comments, their whole comment tree, '
+                                 'or as much of the tree as is needed for a confident estimate')
+
+    def handle(self, *args, **options):
+
+        """Ingest new stories until stopped
+        """
+
+        # Imported here so other commands don't pay for loading the clients and models
+        import updateDB
+
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping after the current run')
+            stopping.set()
+
+        handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        cache = updateDB.AliasCache()
+        try:
+            while not stopping.is_set():
+                started = time.time()
+                close_old_connections()
+                with updateDB.lock(options['lock']) as acquired:
+                    if not acquired:
+                        self.stderr.write('Another update is already running, skipping this run')
+                    else:
+                        try:
+                            updateDB.updateDB(cache=cache, mode=options['mode'])
+                        except Exception:
+                            # Keep running, the next run may well succeed
+                            self.stderr.write(traceback.format_exc())
+                if options['once']:
+                    break
+                # A run that takes longer than the interval is followed straight away by the next
+                stopping.wait(max(0, options['interval'] - (time.time() - started)))
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
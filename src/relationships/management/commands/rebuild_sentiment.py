@@ -0,0 +1,20 @@
+"""Recalculates the sentiment totals kept on each node.
+"""
+from django.core.management.base import BaseCommand
+from relationships.models import Node
+
+
+class Command(BaseCommand):
+
+    """Command that rebuilds the sentiment totals of every node from their `Sentiment`s
+    """
+
+    help = 'Recalculates the sentiment totals of every node from the sentiment history'
+
+    def handle(self, *args, **options):
+
+        """Rebuild the sentiment totals
+        """
+
+        Node.rebuildSentiment()
+        self.stdout.write('Rebuilt the sentiment of ' + str(Node.objects.filter(sentimentCount__gt=0).count()) + ' nodes')
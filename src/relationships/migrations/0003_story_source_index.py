@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0002_auto_20170207_1839'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='story',
+            name='source',
+            field=models.URLField(db_index=True, max_length=1000),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0003_story_source_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Alias',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keyword', models.CharField(max_length=255, unique=True)),
+                ('heading', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date Resolved')),
+            ],
+        ),
+    ]
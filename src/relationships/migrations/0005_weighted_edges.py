@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def collapse_edges(apps, schema_editor):
+
+    """Merge the edges between each pair of nodes into a single weighted edge
+    """
+
+    Edge = apps.get_model('relationships', 'Edge')
+    pairs = {}
+    for edge in Edge.objects.order_by('date', 'id'):
+        pair = tuple(sorted((edge.origin_id, edge.destination_id)))
+        if pair[0] == pair[1]:
+            edge.delete()
+        elif pair not in pairs:
+            edge.origin_id, edge.destination_id = pair
+            edge.lastSeen = edge.date
+            pairs[pair] = edge
+        else:
+            kept = pairs[pair]
+            kept.weight += 1
+            kept.lastSeen = edge.date
+            kept.source = edge.source
+            edge.delete()
+    for edge in pairs.values():
+        edge.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0004_alias'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='edge',
+            name='lastSeen',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date Last Seen'),
+        ),
+        migrations.AddField(
+            model_name='edge',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(collapse_edges, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='edge',
+            unique_together=set([('origin', 'destination')]),
+        ),
+    ]
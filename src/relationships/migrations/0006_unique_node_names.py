@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def merge_nodes(apps, schema_editor):
+
+    """Merge nodes with the same name into the oldest of them, along with their sentiments and edges
+    """
+
+    Node = apps.get_model('relationships', 'Node')
+    Edge = apps.get_model('relationships', 'Edge')
+    Sentiment = apps.get_model('relationships', 'Sentiment')
+    kept = {}
+    merged = {}
+    for node in Node.objects.order_by('id'):
+        if node.name not in kept:
+            kept[node.name] = node
+        else:
+            merged[node.id] = kept[node.name].id
+            kept[node.name].date = max(kept[node.name].date, node.date)
+    if len(merged) == 0:
+        return
+    for node in kept.values():
+        node.save()
+    for duplicate, node in merged.items():
+        Sentiment.objects.filter(node_id=duplicate).update(node_id=node)
+    affected = Edge.objects.filter(models.Q(origin_id__in=merged.keys()) | models.Q(destination_id__in=merged.keys()))
+    for edge in affected.order_by('id'):
+        pair = sorted((merged.get(edge.origin_id, edge.origin_id), merged.get(edge.destination_id, edge.destination_id)))
+        if pair[0] == pair[1]:
+            edge.delete()
+            continue
+        other = Edge.objects.filter(origin_id=pair[0], destination_id=pair[1]).exclude(id=edge.id).first()
+        if other is None:
+            edge.origin_id, edge.destination_id = pair
+            edge.save()
+            continue
+        other.weight += edge.weight
+        other.date = min(other.date, edge.date)
+        if edge.lastSeen > other.lastSeen:
+            other.lastSeen = edge.lastSeen
+            other.source = edge.source
+        other.save()
+        edge.delete()
+    Node.objects.filter(id__in=merged.keys()).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0005_weighted_edges'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_nodes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='node',
+            name='name',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def total_sentiment(apps, schema_editor):
+
+    """Calculate the sentiment totals of every node from their existing sentiments
+    """
+
+    Node = apps.get_model('relationships', 'Node')
+    Sentiment = apps.get_model('relationships', 'Sentiment')
+    totals = (Sentiment.objects.filter(sentiment__isnull=False).values('node')
+              .annotate(count=models.Count('id'), total=models.Sum('sentiment')))
+    for row in totals:
+        Node.objects.filter(pk=row['node']).update(sentimentCount=row['count'], sentimentSum=row['total'],
+                                                   sentimentUpdated=django.utils.timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0006_unique_node_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='sentimentCount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='sentimentSum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='sentimentUpdated',
+            field=models.DateTimeField(blank=True, default=None, null=True, verbose_name='Date Sentiment Updated'),
+        ),
+        migrations.RunPython(total_sentiment, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0007_node_sentiment_totals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='node',
+            name='date',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Date Collected'),
+        ),
+    ]
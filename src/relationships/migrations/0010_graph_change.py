@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0009_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(db_index=True)),
+                ('kind', models.CharField(choices=[('node', 'Node'), ('link', 'Link')], max_length=4)),
+                ('action', models.CharField(choices=[('add', 'Added'), ('update', 'Updated'), ('remove', 'Removed')], max_length=6)),
+                ('key', models.CharField(max_length=255)),
+                ('data', models.TextField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0010_graph_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snapshot',
+            name='compact',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='snapshot',
+            name='compactCompressed',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relationships', '0011_compact_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='x',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='y',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -1,10 +1,22 @@
 """Models of data to be stored in the database
 """
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.utils import timezone
 import datetime
 
 
+def recentSince():
+
+    """Returns the earliest date that is still recent
+
+    Returns:
+        obj: The date three days ago
+    """
+
+    return timezone.now() - datetime.timedelta(days=3)
+
+
 class Story(models.Model):
 
     """Model to store each news story retrieved
@@ -15,7 +27,7 @@ class Story(models.Model):
         source (obj): Object to describe the source of `Story`
     """
 
-    source = models.URLField(max_length=1000)
+    source = models.URLField(max_length=1000, db_index=True)
     content = models.TextField()
     date = models.DateTimeField('Date Collected', default=timezone.now)
 
@@ -27,7 +39,7 @@ class Story(models.Model):
             bool: Was `self` recent?
         """
 
-        return self.date >= timezone.now() - datetime.timedelta(days=3)
+        return self.date >= recentSince()
 
     def __str__(self):
 
@@ -47,11 +59,21 @@ class Node(models.Model):
         collectedFrom (obj): Object to describe which `Story` the node was retrieved from
         date (obj): Object to describe when the node was created and last updated
         name (obj): Object to describe the name of the node
+        sentimentCount (obj): Object to describe the number of `Sentiment`s of the node
+        sentimentSum (obj): Object to describe the total of the `Sentiment`s of the node
+        sentimentUpdated (obj): Object to describe when the node last had a `Sentiment` added
+        x (obj): Object to describe the horizontal position of the node in the layout
+        y (obj): Object to describe the vertical position of the node in the layout
     """
 
-    name = models.CharField(max_length=50)
-    date = models.DateTimeField('Date Collected', default=timezone.now)
+    name = models.CharField(max_length=50, unique=True)
+    date = models.DateTimeField('Date Collected', default=timezone.now, db_index=True)
     collectedFrom = models.ForeignKey(Story, related_name='story_collected_from', default="")
+    sentimentCount = models.PositiveIntegerField(default=0)
+    sentimentSum = models.FloatField(default=0)
+    sentimentUpdated = models.DateTimeField('Date Sentiment Updated', null=True, blank=True, default=None)
+    x = models.FloatField(null=True, blank=True, default=None)
+    y = models.FloatField(null=True, blank=True, default=None)
 
     def recent(self):
 
@@ -61,7 +83,31 @@ class Node(models.Model):
             bool: Was `self` recent?
         """
 
-        return self.date >= timezone.now() - datetime.timedelta(days=3)
+        return self.date >= recentSince()
+
+    def sentiment(self):
+
+        """Returns the average sentiment of `self`
+
+        Returns:
+            float: The average sentiment. `None` if `self` has no sentiment
+        """
+
+        return self.sentimentSum / self.sentimentCount if self.sentimentCount > 0 else None
+
+    @classmethod
+    def rebuildSentiment(cls):
+
+        """Recalculates the sentiment totals of every node from their `Sentiment`s
+        """
+
+        totals = (Sentiment.objects.filter(sentiment__isnull=False).values('node')
+                  .annotate(count=models.Count('id'), total=models.Sum('sentiment')))
+        with transaction.atomic():
+            cls.objects.update(sentimentCount=0, sentimentSum=0)
+            for row in totals:
+                cls.objects.filter(pk=row['node']).update(sentimentCount=row['count'], sentimentSum=row['total'],
+                                                          sentimentUpdated=timezone.now())
 
     def __str__(self):
 
@@ -78,17 +124,26 @@ class Edge(models.Model):
 
     """Model to store each edge in the graph
 
+    There is one edge for each pair of nodes that have been in a story together, with `origin` having the lower ID.
+
     Attributes:
-        date (obj): Object to describe the date when the edge was created
+        date (obj): Object to describe the date when the edge was first seen
         destination (obj): Object to describe the destination of the edge
+        lastSeen (obj): Object to describe the date when the edge was last seen
         origin (obj): Object to describe the origin `Node` of the edge
-        source (obj): Object to describe the source `Node` of the edge
+        source (obj): Object to describe the source of the story the edge was last seen in
+        weight (obj): Object to describe the number of stories the edge has been seen in
     """
 
     source = models.URLField(max_length=1000)
     origin = models.ForeignKey(Node, related_name='origin_node')
     destination = models.ForeignKey(Node, related_name='destination_node')
     date = models.DateTimeField('Date Collected', default=timezone.now)
+    lastSeen = models.DateTimeField('Date Last Seen', default=timezone.now, db_index=True)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('origin', 'destination')
 
     def recent(self):
 
@@ -132,3 +187,126 @@ class Sentiment(models.Model):
         """
 
         return str(self.sentiment)
+
+
+class Alias(models.Model):
+
+    """Model to cache which Wikipedia article each keyword refers to
+
+    Attributes:
+        date (obj): Object to describe when `keyword` was last looked up
+        heading (obj): Object to describe the heading of the article. `None` if there is no article
+        keyword (obj): Object to describe the keyword as it was chunked from a story
+    """
+
+    keyword = models.CharField(max_length=255, unique=True)
+    heading = models.CharField(max_length=255, null=True, blank=True, default=None)
+    date = models.DateTimeField('Date Resolved', default=timezone.now)
+
+    def ttl(self):
+
+        """Returns how long `self` is cached for
+
+        Keywords without an article are looked up again sooner, as the article may since have been written.
+
+        Returns:
+            obj: How long `self` is cached for
+        """
+
+        return settings.ALIAS_TTL if self.heading is not None else settings.ALIAS_NEGATIVE_TTL
+
+    def expired(self):
+
+        """Returns whether `self` should be looked up again
+
+        Returns:
+            bool: Has `self` expired?
+        """
+
+        return self.date < timezone.now() - self.ttl()
+
+    def __str__(self):
+
+        """Returns a string when the object is referred to
+
+        Returns:
+            str: The `keyword` and the `heading` it resolves to
+        """
+
+        return self.keyword + " -> " + str(self.heading)
+
+
+class Snapshot(models.Model):
+
+    """Model to store the graph as it was sent to clients after each update
+
+    Attributes:
+        compact (obj): Object to describe the graph serialised in the compact format
+        compactCompressed (obj): Object to describe `compact` compressed with gzip
+        compressed (obj): Object to describe `content` compressed with gzip
+        content (obj): Object to describe the graph serialised as JSON
+        date (obj): Object to describe when the snapshot was published
+        etag (obj): Object to describe the hash of `content` used to tell whether clients are up to date
+    """
+
+    content = models.BinaryField()
+    compressed = models.BinaryField()
+    compact = models.BinaryField(default=b'')
+    compactCompressed = models.BinaryField(default=b'')
+    etag = models.CharField(max_length=40)
+    date = models.DateTimeField('Date Published', default=timezone.now)
+
+    def version(self):
+
+        """Returns the version of the graph held in `self`
+
+        Returns:
+            int: Version of the graph. Later snapshots have higher versions.
+        """
+
+        return self.id
+
+    def __str__(self):
+
+        """Returns a string when the object is referred to
+
+        Returns:
+            str: The version and `etag` of the snapshot
+        """
+
+        return str(self.id) + " (" + self.etag + ")"
+
+
+class GraphChange(models.Model):
+
+    """Model to log how each published version of the graph differs from the one before
+
+    Attributes:
+        action (obj): Object to describe whether the item was added, updated or removed
+        data (obj): Object to describe the item as it is sent to clients, serialised as JSON
+        key (obj): Object to describe the item. The name of a node, or the names of both ends of a link.
+        kind (obj): Object to describe whether the item is a node or a link
+        version (obj): Object to describe the version of the graph the change was published in
+    """
+
+    NODE = 'node'
+    LINK = 'link'
+    ADD = 'add'
+    UPDATE = 'update'
+    REMOVE = 'remove'
+
+    version = models.PositiveIntegerField(db_index=True)
+    kind = models.CharField(max_length=4, choices=((NODE, 'Node'), (LINK, 'Link')))
+    action = models.CharField(max_length=6, choices=((ADD, 'Added'), (UPDATE, 'Updated'), (REMOVE, 'Removed')))
+    key = models.CharField(max_length=255)
+    data = models.TextField()
+
+    def __str__(self):
+
+        """Returns a string when the object is referred to
+
+        Returns:
+            str: The version, action and key of the change
+        """
+
+        return str(self.version) + ": " + self.action + " " + self.key
@@ -1,10 +1,23 @@
 """Tests to news-graph views and associated functions
 """
 from django.test import TestCase
-from .models import Node, Edge, Sentiment, Story
+from .models import Node, Edge, Sentiment, Story, Alias, Snapshot
 from django.utils import timezone
 import datetime
 from django.urls import reverse
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from . import detail, engine, graph, layout
+import gzip
+import json
+import base64
+import threading
+import time
+import numpy
+from django.core.cache import cache
+from unittest import mock
+import io
 
 
 class DatabaseTestCases(TestCase):
@@ -50,6 +63,39 @@ class DatabaseTestCases(TestCase):
         new_story = Story(source='http://example.com/2/', content='This is also title', date=time)
         self.assertIs(new_story.recent(), True)
 
+    def test_alias_expiry(self):
+
+        """Test that keywords without an article expire sooner than those with one
+        """
+
+        time = timezone.now() - datetime.timedelta(days=2)
+        self.assertIs(Alias(keyword='EU', heading='European Union', date=time).expired(), False)
+        self.assertIs(Alias(keyword='Nobody', heading=None, date=time).expired(), True)
+
+    def test_rebuild_sentiment(self):
+
+        """Test that the sentiment totals of nodes can be rebuilt from their sentiments
+        """
+
+        node = Node.objects.get(name='Key word')
+        Sentiment(sentiment=0.2, node=node).save()
+        Sentiment(sentiment=0.6, node=node).save()
+        Sentiment(sentiment=None, node=node).save()
+        self.assertIsNone(node.sentiment())
+        call_command('rebuild_sentiment', stdout=io.StringIO())
+        node = Node.objects.get(name='Key word')
+        self.assertEqual(node.sentimentCount, 2)
+        self.assertAlmostEqual(node.sentiment(), 0.4)
+
+    def test_node_names_unique(self):
+
+        """Test that two nodes can't share a name
+        """
+
+        story = Story.objects.get(source='http://example.com/')
+        with self.assertRaises(IntegrityError):
+            Node(name='Key word', date=timezone.now(), collectedFrom=story).save()
+
     def test_human_readable_output(self):
 
         """Test that the `__str__()` function functions correctly
@@ -73,10 +119,11 @@ class ViewTestCases(TestCase):
         s.save()
         node1 = Node(name='Key word', date=timezone.now(), collectedFrom=s)
         node1.save()
-        node2 = Node(name='Key word', date=timezone.now(), collectedFrom=s)
+        node2 = Node(name='Key word 2', date=timezone.now(), collectedFrom=s)
         node2.save()
         link = Edge(source=s, origin=node1, destination=node2)
         link.save()
+        Node.objects.filter(pk=node1.pk).update(sentimentCount=2, sentimentSum=0.8)
 
     def test_home_view(self):
 
@@ -95,3 +142,374 @@ class ViewTestCases(TestCase):
         response = self.client.get(reverse('ajax'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, '"name": "Key word"')
+        self.assertContains(response, '"weight": 1')
+        self.assertContains(response, '"sentiment": 0.5')
+
+    def test_graph_queries(self):
+
+        """Test that building the graph makes the same number of queries however many nodes there are
+        """
+
+        s = Story.objects.get(source='http://example.com/')
+        old = Node(name='Old key word', date=timezone.now() - datetime.timedelta(days=10), collectedFrom=s)
+        old.save()
+        Edge(source=s, origin=Node.objects.get(name='Key word'), destination=old).save()
+        for i in range(10):
+            Node(name='Key word ' + str(i + 3), date=timezone.now(), collectedFrom=s).save()
+        with self.assertNumQueries(2):
+            out = graph.build()
+        self.assertNotIn('Old key word', [node['name'] for node in out['nodes']])
+        self.assertEqual(out['links'][0]['target'], 'Key word 2')
+        self.assertEqual(len(out['nodes']), 12)
+
+    def test_ajax_view_snapshot(self):
+
+        """Test that the AJAX view serves the latest snapshot, compressed or not, and 304s clients that have it
+        """
+
+        graph.publish()
+        Node(name='Key word 3', date=timezone.now(), collectedFrom=Story.objects.get()).save()
+        response = self.client.get(reverse('ajax'))
+        self.assertNotContains(response, 'Key word 3')
+        snapshot = graph.publish()
+        response = self.client.get(reverse('ajax'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'Key word 3', gzip.decompress(response.content))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('ajax'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn(snapshot.etag, response['ETag'])
+
+    def test_graph_rebuilt_once(self):
+
+        """Test that only one request rebuilds a stale graph while the others get the previous version
+        """
+
+        previous = graph.publish()
+        Snapshot.objects.update(date=timezone.now() - datetime.timedelta(days=1))
+        cache.add(graph.LEASE, True)
+        try:
+            with mock.patch.object(graph, 'publish') as publish:
+                self.assertEqual(graph.latest().etag, previous.etag)
+                self.assertEqual(graph.rebuild(wait=0), publish.return_value)
+                self.assertEqual(publish.call_count, 1)
+        finally:
+            cache.delete(graph.LEASE)
+        self.assertFalse(graph.stale(graph.latest()))
+        # Nothing had changed, so the previous version is kept
+        self.assertEqual(Snapshot.objects.get().id, previous.id)
+
+    def test_publish_waits_for_rebuild(self):
+
+        """Test that publishing waits for a rebuild in progress, so they don't diff against the same snapshot
+        """
+
+        cache.add(graph.LEASE, True)
+        with mock.patch.object(graph, '_publish') as inner:
+            thread = threading.Thread(target=graph.publish)
+            thread.start()
+            thread.join(0.2)
+            self.assertFalse(inner.called)
+            cache.delete(graph.LEASE)
+            thread.join(5)
+            self.assertEqual(inner.call_count, 1)
+        # The lease is given up afterwards
+        self.assertTrue(cache.add(graph.LEASE, True))
+        cache.delete(graph.LEASE)
+
+    def test_delta_view(self):
+
+        """Test that the delta view returns only what changed since the client's version
+        """
+
+        version = graph.publish().version()
+        s = Story.objects.get()
+        Node(name='Key word 3', date=timezone.now(), collectedFrom=s).save()
+        Node.objects.filter(name='Key word').update(sentimentCount=1, sentimentSum=0)
+        Node.objects.filter(name='Key word 2').update(date=timezone.now() - datetime.timedelta(days=10))
+        graph.publish()
+        response = self.client.get(reverse('delta'), {'since': version})
+        out = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(out['version'], version + 1)
+        self.assertEqual([node['name'] for node in out['nodes']['added']], ['Key word 3'])
+        self.assertEqual(out['nodes']['updated'], [{'name': 'Key word', 'sentiment': 0.0, 'x': None, 'y': None}])
+        self.assertEqual([node['name'] for node in out['nodes']['removed']], ['Key word 2'])
+        self.assertEqual(out['links']['removed'][0]['target'], 'Key word 2')
+        response = self.client.get(reverse('delta'), {'since': version + 1})
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['nodes']['added'], [])
+        with self.settings(GRAPH_CHANGES=0):
+            self.assertEqual(self.client.get(reverse('delta'), {'since': version}).status_code, 410)
+        self.assertEqual(self.client.get(reverse('delta')).status_code, 400)
+
+    def test_ajax_view_stream(self):
+
+        """Test that the streamed graph is the same as the built one, compressed or not
+        """
+
+        s = Story.objects.get()
+        for i in range(5):
+            Node(name='Key word ' + str(i + 3), date=timezone.now(), collectedFrom=s).save()
+        response = self.client.get(reverse('ajax'), {'stream': 1})
+        content = b''.join(response.streaming_content)
+        self.assertEqual(json.loads(content.decode('utf-8')), json.loads(json.dumps(graph.build())))
+        self.assertEqual(b''.join(graph.stream(chunk=2)), content)
+        response = self.client.get(reverse('ajax'), {'stream': 1}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), content)
+
+    def test_ajax_view_compact(self):
+
+        """Test that the compact format holds the same graph as the JSON one
+        """
+
+        graph.publish()
+        full = json.loads(self.client.get(reverse('ajax')).content.decode('utf-8'))
+        response = self.client.get(reverse('ajax'), HTTP_ACCEPT=graph.COMPACT)
+        self.assertEqual(response['Content-Type'], graph.COMPACT)
+        out = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(out['version'], full['version'])
+        self.assertEqual(out['names'], [node['name'] for node in full['nodes']])
+        sentiment = numpy.frombuffer(base64.b64decode(out['sentiment']), dtype='<f4')
+        self.assertTrue(numpy.allclose(sentiment, [node['sentiment'] for node in full['nodes']]))
+        ends = numpy.frombuffer(base64.b64decode(out['links']), dtype='<u4').reshape(-1, 2)
+        self.assertEqual([[out['names'][i] for i in pair] for pair in ends],
+                         [[link['source'], link['target']] for link in full['links']])
+        self.assertEqual(list(numpy.frombuffer(base64.b64decode(out['weights']), dtype='<u4')), [1])
+        self.assertEqual(out['origins'], ['http://example.com/'])
+        response = self.client.get(reverse('ajax'), {'format': 'compact'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content).decode('utf-8')), out)
+
+    def test_gzip_content(self):
+
+        """Test that content is compressed without a timestamp, so it always compresses the same
+        """
+
+        content = graph.gzipContent(b'{"nodes": []}')
+        self.assertEqual(gzip.decompress(content), b'{"nodes": []}')
+        self.assertEqual(content[4:8], b'\0\0\0\0')
+
+
+class LayoutTestCases(TestCase):
+
+    """Tests that the graph is laid out on the server
+    """
+
+    def test_force_layout(self):
+
+        """Test that linked nodes end up closer together than unlinked ones
+        """
+
+        ends = [(0, 1), (1, 2), (0, 2), (3, 4), (4, 5), (3, 5)]
+        positions = layout.forceLayout(numpy.full((6, 2), numpy.nan), ends, size=100)
+        distance = numpy.sqrt(((positions[:, None, :] - positions[None, :, :]) ** 2).sum(axis=2))
+        self.assertLess(distance[0, 1], distance[0, 4])
+        self.assertLess(distance[3, 5], distance[2, 3])
+        # A low temperature only lets the nodes settle
+        settled = layout.forceLayout(positions, ends, size=100, iterations=5, temperature=1)
+        self.assertLess(numpy.abs(settled - positions).max(), 5)
+
+    def test_update(self):
+
+        """Test that new nodes are laid out next to the nodes they are linked to and the positions are sent to clients
+        """
+
+        s = Story(source='http://example.com/', content='This is a title')
+        s.save()
+        nodes = [Node(name='Key word ' + str(i), collectedFrom=s, x=i * 10.0, y=0.0) for i in range(4)]
+        for node in nodes:
+            node.save()
+        new = Node(name='New key word', collectedFrom=s)
+        new.save()
+        Edge(source=s, origin=nodes[3], destination=new).save()
+        self.assertEqual(layout.update(), 5)
+        new = Node.objects.get(name='New key word')
+        self.assertLess(abs(new.x - Node.objects.get(name='Key word 3').x), 200)
+        self.assertIn({'name': 'New key word', 'sentiment': 0.75, 'x': new.x, 'y': new.y}, graph.build()['nodes'])
+
+    def test_update_many(self):
+
+        """Test that saving the positions of many nodes stays under the SQL variable limit of SQLite
+        """
+
+        s = Story(source='http://example.com/', content='This is a title')
+        s.save()
+        Node.objects.bulk_create(Node(name='Key word ' + str(i), collectedFrom=s, date=timezone.now())
+                                 for i in range(600))
+        with self.settings(LAYOUT_ITERATIONS=1), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(layout.update(), 600)
+        # Older builds of SQLite allow 999 variables, which 200 nodes saved at once would pass
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 4)
+        self.assertFalse(Node.objects.filter(x__isnull=True).exists())
+
+
+class DetailTestCases(TestCase):
+
+    """Tests that the graph can be sent at lower levels of detail
+    """
+
+    def setUp(self):
+
+        """Generate two triangles of nodes joined by a single link
+        """
+
+        cache.clear()
+        s = Story(source='http://example.com/', content='This is a title')
+        s.save()
+        nodes = [Node(name='Key word ' + str(i), collectedFrom=s, x=float(i), y=0.0) for i in range(6)]
+        for node in nodes:
+            node.save()
+        for a, b in ((0, 1), (1, 2), (0, 2), (3, 4), (4, 5), (3, 5), (2, 3)):
+            Edge(source=s, origin=nodes[a], destination=nodes[b], weight=2 if a == 0 else 1).save()
+        self.snapshot = graph.publish()
+
+    def test_communities(self):
+
+        """Test that each triangle is found to be a community
+        """
+
+        labels = detail.communities(graph.build())
+        self.assertEqual(len(set(labels[:3])), 1)
+        self.assertEqual(len(set(labels[3:])), 1)
+        self.assertNotEqual(labels[0], labels[3])
+
+    def test_lod_views(self):
+
+        """Test that the top nodes, the collapsed communities and the members of a community can be fetched
+        """
+
+        out = json.loads(self.client.get(reverse('ajax'), {'lod': 'top', 'k': 2}).content.decode('utf-8'))
+        self.assertEqual([node['name'] for node in out['nodes']], ['Key word 0', 'Key word 2'])
+        self.assertEqual(len(out['links']), 1)
+        out = json.loads(self.client.get(reverse('ajax'), {'lod': 'communities'}).content.decode('utf-8'))
+        self.assertEqual([node['members'] for node in out['nodes']], [3, 3])
+        self.assertEqual(out['nodes'][0]['x'], 1.0)
+        self.assertEqual(out['links'][0]['weight'], 1)
+        response = self.client.get(reverse('community', args=[out['nodes'][0]['community']]),
+                                   {'version': out['version']})
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))['links']), 3)
+        self.assertEqual(self.client.get(reverse('community', args=[5])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('community', args=[0]), {'version': 100}).status_code, 410)
+        self.assertEqual(self.client.get(reverse('ajax'), {'lod': 'everything'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('ajax'), {'lod': 'top', 'k': -1}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('ajax'), {'lod': 'top', 'k': 0}).status_code, 400)
+
+    def test_lod_cached(self):
+
+        """Test that each level of detail is only built once for each version of the graph
+        """
+
+        with mock.patch.object(detail, 'communities', wraps=detail.communities) as communities:
+            self.client.get(reverse('ajax'), {'lod': 'communities'})
+            self.client.get(reverse('ajax'), {'lod': 'communities'})
+            self.client.get(reverse('community', args=[0]))
+            self.assertEqual(communities.call_count, 1)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('ajax'), {'lod': 'communities'})
+
+
+class EngineTestCases(TestCase):
+
+    """Tests that the graph held in memory answers questions and keeps up with the database
+    """
+
+    def setUp(self):
+
+        """Generate a chain of nodes
+        """
+
+        self.story = Story(source='http://example.com/', content='This is a title')
+        self.story.save()
+        self.nodes = [Node(name='Key word ' + str(i), collectedFrom=self.story) for i in range(5)]
+        for node in self.nodes:
+            node.save()
+        for a, b in ((0, 1), (1, 2), (2, 3)):
+            Edge(source=self.story, origin=self.nodes[a], destination=self.nodes[b]).save()
+
+    def test_queries(self):
+
+        """Test the neighbours, degree and paths of nodes
+        """
+
+        csr = engine.Engine().refresh()
+        ids = [node.id for node in self.nodes]
+        self.assertEqual(sorted(csr.neighbours(ids[1])), [ids[0], ids[2]])
+        self.assertEqual(csr.degree(ids[2]), 2)
+        self.assertEqual(csr.degree(ids[4]), 0)
+        self.assertEqual(csr.path(ids[0], ids[3]), ids[:4])
+        self.assertIsNone(csr.path(ids[0], ids[4]))
+        self.assertIsNone(csr.path(ids[0], ids[3], depth=2))
+        self.assertEqual(len(csr.neighbours(ids[1], since=time.time() + 60)), 0)
+        with self.assertRaises(KeyError):
+            csr.neighbours(ids[4] + 1)
+
+    def test_refresh(self):
+
+        """Test that a refresh only reads new nodes and the edges seen since the last one
+        """
+
+        graph = engine.Engine()
+        graph.refresh()
+        new = Node(name='Key word 5', collectedFrom=self.story)
+        new.save()
+        Edge(source=self.story, origin=self.nodes[4], destination=new).save()
+        Edge.objects.filter(origin=self.nodes[0]).update(weight=3, lastSeen=timezone.now())
+        Edge.objects.filter(origin=self.nodes[1]).update(lastSeen=timezone.now() - datetime.timedelta(days=1))
+        with CaptureQueriesContext(connection) as queries:
+            csr = graph.refresh()
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"lastSeen" >=', queries[0]['sql'])
+        self.assertEqual(list(csr.neighbours(new.id)), [self.nodes[4].id])
+        self.assertEqual(csr.degree(self.nodes[1].id, weighted=True), 4)
+        self.assertEqual(csr.path(self.nodes[0].id, self.nodes[3].id)[-1], self.nodes[3].id)
+
+    def test_refresh_without_edges(self):
+
+        """Test that a graph first loaded without any edges is still refreshed from a cursor
+        """
+
+        Edge.objects.all().delete()
+        graph = engine.Engine()
+        graph.refresh()
+        self.assertIsNotNone(graph.cursor)
+        Edge(source=self.story, origin=self.nodes[0], destination=self.nodes[1]).save()
+        with CaptureQueriesContext(connection) as queries:
+            csr = graph.refresh()
+        self.assertIn('"lastSeen" >=', queries[0]['sql'])
+        self.assertEqual(list(csr.neighbours(self.nodes[0].id)), [self.nodes[1].id])
+
+    def test_views(self):
+
+        """Test that the neighbours of a node and the path between two nodes can be fetched
+        """
+
+        with mock.patch.object(engine, '_engine', None):
+            out = json.loads(self.client.get(reverse('neighbours'), {'name': 'Key word 1'}).content.decode('utf-8'))
+            self.assertEqual(out['neighbours'], ['Key word 0', 'Key word 2'])
+            self.assertEqual(out['weight'], 2)
+            out = json.loads(self.client.get(reverse('path'), {'from': 'Key word 0', 'to': 'Key word 3'})
+                             .content.decode('utf-8'))
+            self.assertEqual(out['path'], ['Key word 0', 'Key word 1', 'Key word 2', 'Key word 3'])
+            out = json.loads(self.client.get(reverse('path'), {'from': 'Key word 0', 'to': 'Key word 4'})
+                             .content.decode('utf-8'))
+            self.assertIsNone(out['path'])
+            self.assertEqual(self.client.get(reverse('neighbours'), {'name': 'Nobody'}).status_code, 404)
+            self.assertEqual(self.client.get(reverse('path'), {'from': 'Key word 0', 'to': 'Nobody'}).status_code, 404)
+            self.assertEqual(self.client.get(reverse('path'), {'from': 'Key word 0'}).status_code, 400)
+
+    def test_views_new_node(self):
+
+        """Test that a node added since the graph in memory was last refreshed is loaded rather than not found
+        """
+
+        with mock.patch.object(engine, '_engine', None):
+            engine.get()
+            new = Node(name='Key word 5', collectedFrom=self.story)
+            new.save()
+            Edge(source=self.story, origin=self.nodes[3], destination=new).save()
+            out = json.loads(self.client.get(reverse('neighbours'), {'name': 'Key word 5'}).content.decode('utf-8'))
+            self.assertEqual(out['neighbours'], ['Key word 3'])
+            out = json.loads(self.client.get(reverse('path'), {'from': 'Key word 0', 'to': 'Key word 5'})
+                             .content.decode('utf-8'))
+            self.assertEqual(out['path'][-1], 'Key word 5')
+            with mock.patch.object(engine.CSR, '__contains__', return_value=False):
+                self.assertEqual(self.client.get(reverse('neighbours'), {'name': 'Key word 5'}).status_code, 503)
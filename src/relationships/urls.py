@@ -4,4 +4,8 @@ from . import views
 urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^ajax/$', views.ajax, name='ajax'),
+    url(r'^ajax/delta/$', views.delta, name='delta'),
+    url(r'^ajax/community/(?P<community>[0-9]+)/$', views.community, name='community'),
+    url(r'^ajax/neighbours/$', views.neighbours, name='neighbours'),
+    url(r'^ajax/path/$', views.path, name='path'),
 ]
@@ -1,16 +1,58 @@
 """Render the views
 """
 from django.shortcuts import render
-from django.http import HttpResponse
-from .models import Node, Edge, Sentiment
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from . import detail, engine, graph
+from .models import Node
+import calendar
 import json
-from numpy import interp
+
+
+def send(request, snapshot, variant, content, compact, gzipped):
+
+    """Returns a response containing a version of the graph, or a 304 if the client already has it
+
+    Args:
+        request (obj): The request made to the server
+        snapshot (obj): The `Snapshot` of the graph
+        variant (str): What is sent of the graph, used to tell apart the etags of each variant
+        content (function): Returns the bytes to be sent
+        compact (bool): Is the graph in the compact format?
+        gzipped (bool): Is the graph compressed with gzip?
+
+    Returns:
+        obj: HTTP response containing the JSON
+    """
+
+    # The same etag is used for both encodings, so it is weak
+    etag = 'W/"' + snapshot.etag + variant + ('-compact"' if compact else '"')
+    modified = calendar.timegm(snapshot.date.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=modified)
+    if response is None:
+        response = HttpResponse(content(), content_type=graph.COMPACT if compact else 'application/json')
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
 
 
 def ajax(request):
 
     """Returns a JSON object to the client containing all the nodes and edges
 
+    The latest snapshot published by ingestion is sent as it is, compressed if the client accepts
+    gzip, and in the compact format if `format` is `compact` or the client accepts `graph.COMPACT`.
+    Clients that already have it are sent a 304 response. With `stream` set, the current
+    graph is serialised instead and streamed to the client as it is read from the database.
+
+    With `lod` set to `top`, only the `k` nodes with the most links are sent. With `lod` set to
+    `communities`, each community of closely linked nodes is sent as a single node.
+
     Args:
         request (obj): The request made to the server
 
@@ -18,37 +60,184 @@ def ajax(request):
         obj: HTTP response containing the JSON
     """
 
-    edges = Edge.objects.all()
-    nodes = Node.objects.all()
-    nodeList = []
-    edgeList = []
-    for node in nodes:
-        if node.recent():
-            n = 0
-            total = 0
-            for obj in Sentiment.objects.filter(node=node):
-                if obj.sentiment is not None:
-                    n += 1
-                    total += obj.sentiment
-
-            avg = total / n if n > 0 else 0.6
-            avg = interp(avg, [0, 0.8], [0, 1])
-            toAdd = {}
-            toAdd['name'] = node.name
-            toAdd['sentiment'] = avg if avg <= 1 else 1
-            nodeList.append(toAdd)
-    for edge in edges:
-        if edge.recent():
-            toAdd = {}
-            toAdd['source'] = edge.origin.name
-            toAdd['target'] = edge.destination.name
-            toAdd['origin'] = edge.source
-            edgeList.append(toAdd)
+    gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if request.GET.get('stream'):
+        response = StreamingHttpResponse(graph.compress(graph.stream()) if gzipped else graph.stream(),
+                                         content_type='application/json')
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    compact = request.GET.get('format') == 'compact' or graph.COMPACT in request.META.get('HTTP_ACCEPT', '')
+    lod = request.GET.get('lod')
+    if lod is None:
+        snapshot = graph.latest()
+        return send(request, snapshot, '', lambda: graph.payload(snapshot, compact, gzipped), compact, gzipped)
+    if lod not in ('top', 'communities'):
+        return HttpResponseBadRequest('lod must be top or communities')
+    try:
+        k = int(request.GET.get('k', settings.GRAPH_DETAIL_NODES)) if lod == 'top' else None
+    except ValueError:
+        return HttpResponseBadRequest('k must be a number of nodes')
+    if k is not None and k < 1:
+        # A negative k would slice nodes off the end rather than take them from the start
+        return HttpResponseBadRequest('k must be at least 1')
+    snapshot = graph.latest()
+    return send(request, snapshot, '-' + lod + ('-' + str(k) if k is not None else ''),
+                lambda: detail.payload(snapshot, lod, k, compact, gzipped), compact, gzipped)
+
+
+def community(request, community):
+
+    """Returns a JSON object to the client containing the members of a community and the links between them
+
+    Args:
+        request (obj): The request made to the server. `version` is the version of the graph the
+            community was found in, defaulting to the latest.
+        community (str): The number of the community, as sent with `lod` set to `communities`
+
+    Returns:
+        obj: HTTP response containing the JSON. 410 if that version of the graph is no longer kept.
+    """
+
+    gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    compact = request.GET.get('format') == 'compact' or graph.COMPACT in request.META.get('HTTP_ACCEPT', '')
+    if 'version' in request.GET:
+        try:
+            snapshot = graph.version(int(request.GET['version']))
+        except ValueError:
+            return HttpResponseBadRequest('version must be the version of the graph')
+        if snapshot is None:
+            return HttpResponse('Version ' + request.GET['version'] + ' of the graph is no longer kept', status=410)
+    else:
+        snapshot = graph.latest()
+    try:
+        return send(request, snapshot, '-community-' + community,
+                    lambda: detail.payload(snapshot, 'community', int(community), compact, gzipped), compact, gzipped)
+    except LookupError:
+        raise Http404('There is no community ' + community)
+
+
+def delta(request):
+
+    """Returns a JSON object to the client containing the changes to the graph since the version it has
+
+    Args:
+        request (obj): The request made to the server. `since` is the version of the graph the client has.
+
+    Returns:
+        obj: HTTP response containing the JSON. 410 if the changes since that version are no longer kept.
+    """
+
+    try:
+        since = int(request.GET['since'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('since must be the version of the graph')
+    snapshot = graph.latest()
+    if since < snapshot.version() - settings.GRAPH_CHANGES:
+        return HttpResponse('Changes since version ' + str(since) + ' are no longer kept', status=410)
+    jsonOut = graph.changes(since)
+    jsonOut['version'] = snapshot.version()
+
+    return HttpResponse(json.dumps(jsonOut), content_type='application/json')
+
+
+def names(ids):
+
+    """Returns the names of nodes
+
+    Args:
+        ids (list): The IDs of the nodes
+
+    Returns:
+        list: The name of each node, in the order of `ids`
+    """
+
+    found = {}
+    # Keep well under the SQL variable limit of SQLite
+    for start in range(0, len(ids), 500):
+        found.update(Node.objects.filter(id__in=ids[start:start + 500]).values_list('id', 'name'))
+    return [found[id] for id in ids if id in found]
+
+
+def notLoaded(name):
+
+    """Returns a response telling the client that a node isn't in the graph held in memory yet
+
+    Args:
+        name (str): The name of the node
+
+    Returns:
+        obj: HTTP response with a 503 status
+    """
+
+    return HttpResponse('Node ' + name + ' has not been loaded yet', status=503)
+
+
+def neighbours(request):
+
+    """Returns a JSON object to the client containing the nodes linked to a node
+
+    Answered from the graph held in memory by `engine`, so it includes links between nodes
+    that are no longer recent.
+
+    Args:
+        request (obj): The request made to the server. `name` is the name of the node.
+
+    Returns:
+        obj: HTTP response containing the JSON. 404 if there is no node called `name`, and 503 if it
+            hasn't been loaded into memory yet.
+    """
+
+    name = request.GET.get('name', '')
+    try:
+        id = Node.objects.values_list('id', flat=True).get(name=name)
+    except Node.DoesNotExist:
+        raise Http404('There is no node called ' + name)
+    csr = engine.get(ids=[id])
+    if id not in csr:
+        return notLoaded(name)
+    found = [int(i) for i in csr.neighbours(id)]
+    weight = csr.degree(id, weighted=True)
+    jsonOut = {}
+    jsonOut['name'] = name
+    jsonOut['weight'] = weight
+    jsonOut['neighbours'] = sorted(names(found))
+
+    return HttpResponse(json.dumps(jsonOut), content_type='application/json')
+
+
+def path(request):
+
+    """Returns a JSON object to the client containing a shortest path between two nodes
+
+    Answered from the graph held in memory by `engine`.
+
+    Args:
+        request (obj): The request made to the server. `from` and `to` are the names of the nodes.
+
+    Returns:
+        obj: HTTP response containing the JSON, whose `path` is the names of the nodes on the path or
+            `null` if they aren't linked. 404 if either node doesn't exist, and 503 if either hasn't been
+            loaded into memory yet.
+    """
+
+    if 'from' not in request.GET or 'to' not in request.GET:
+        return HttpResponseBadRequest('from and to must be the names of nodes')
+    ends = [request.GET['from'], request.GET['to']]
+    ids = dict(Node.objects.filter(name__in=ends).values_list('name', 'id'))
+    for name in ends:
+        if name not in ids:
+            raise Http404('There is no node called ' + name)
+    csr = engine.get(ids=list(ids.values()))
+    for name in ends:
+        if ids[name] not in csr:
+            return notLoaded(name)
+    found = csr.path(ids[ends[0]], ids[ends[1]])
     jsonOut = {}
-    jsonOut['links'] = edgeList
-    jsonOut['nodes'] = nodeList
+    jsonOut['path'] = names(found) if found is not None else None
 
-    return HttpResponse(json.dumps(jsonOut))
+    return HttpResponse(json.dumps(jsonOut), content_type='application/json')
 
 
 def index(request):
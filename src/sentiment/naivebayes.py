@@ -1,9 +1,38 @@
 """Tools needed to generate sentiment using a naive bayes classifier.
+
+The classifier is compiled from the corpora into a model artifact, which is loaded with `load`.
+Run `python -m sentiment.naivebayes` to build it ahead of time.
+
+Attributes:
+    CORPORA (list): Locations of the positive and negative corpora the classifier is trained on.
+    MODEL_DIR (str): Location of the compiled model artifact.
+    VERSION (int): Version of the model artifact format. Artifacts of another version are rebuilt.
 """
 
-from nltk.corpus import stopwords
 from collections import Counter
+import functools
+import hashlib
+import json
+import os
 import string
+import numpy as np
+
+CORPORA = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pos.txt'),
+           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'neg.txt')]
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model')
+VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def stop_words():
+
+    """Load the English stop words once
+    Returns:
+        frozenset: Words that are ignored by the classifier
+    """
+
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
 
 
 def generate(fp, lexicon):
@@ -35,14 +64,14 @@ def lexicon():
         Dict: Dictionary of all words as keys and 0s as values
     """
 
-    stop_words = set(stopwords.words('english'))
-    with open('sentiment/pos.txt', 'r') as fp:
+    stop = stop_words()
+    with open(CORPORA[0], 'r') as fp:
         pos = fp.read()
-    with open('sentiment/neg.txt', 'r') as fp:
+    with open(CORPORA[1], 'r') as fp:
         neg = fp.read()
     words = pos + neg
     lexicon = []
-    [lexicon.append(word.replace('\n', '').lower()) for word in words.split(' ') if word not in stop_words and word not in string.punctuation]
+    [lexicon.append(word.replace('\n', '').lower()) for word in words.split(' ') if word not in stop and word not in string.punctuation]
     lexicon_frequency = Counter(lexicon)
     lexicon_frequency = dict(lexicon_frequency)
     for key in lexicon_frequency:
@@ -66,13 +95,180 @@ def sentiment(sentence, pos_lex, neg_lex):
     p_neg = 0.5
     p_pos_sentiment = p_pos
     for word in s:
-        if word in pos_lex and word not in set(stopwords.words('english')):
+        if word in pos_lex and word not in stop_words():
             p_pos_sentiment = p_pos_sentiment * pos_lex[word]
     p_neg_sentiment = p_neg
     for word in s:
-        if word in neg_lex and word not in set(stopwords.words('english')):
+        if word in neg_lex and word not in stop_words():
             p_neg_sentiment = p_neg_sentiment * neg_lex[word]
     if p_neg_sentiment != 0 and p_pos_sentiment != 0:
         return round(p_pos_sentiment / (p_pos_sentiment + p_neg_sentiment), 4)
     else:
         return 0.5
+
+
+class Model(object):
+
+    """Naive bayes classifier compiled into arrays so that many texts can be scored at once.
+
+    Probabilities are summed in log space, so long texts don't underflow to a neutral sentiment.
+
+    Attributes:
+        log_neg (ndarray): Log probability of each word in `vocabulary` given negative sentiment. 0 for stop words
+        log_pos (ndarray): Log probability of each word in `vocabulary` given positive sentiment. 0 for stop words
+        vocabulary (dict): Index of each word known to the classifier. Index 0 is kept for unknown words
+    """
+
+    def __init__(self, vocabulary, log_pos, log_neg):
+
+        """Create a model
+        Args:
+            vocabulary (dict): Index of each word known to the classifier.
+            log_pos (ndarray): Log probability of each word given positive sentiment.
+            log_neg (ndarray): Log probability of each word given negative sentiment.
+        """
+
+        self.vocabulary = vocabulary
+        self.log_pos = log_pos
+        self.log_neg = log_neg
+
+    @classmethod
+    def compile(cls, pos_lex, neg_lex):
+
+        """Compile the lexicons into a model
+        Args:
+            pos_lex (dict): Lexicon of words and their positive frequency.
+            neg_lex (dict): Lexicon of words and their negative frequency.
+        Returns:
+            Model: The compiled model
+        """
+
+        words = sorted(set(pos_lex) | set(neg_lex))
+        vocabulary = {word: i + 1 for i, word in enumerate(words)}
+        log_pos = np.zeros(len(words) + 1)
+        log_neg = np.zeros(len(words) + 1)
+        for word, i in vocabulary.items():
+            if word not in stop_words():
+                if word in pos_lex:
+                    log_pos[i] = np.log(pos_lex[word])
+                if word in neg_lex:
+                    log_neg[i] = np.log(neg_lex[word])
+        return cls(vocabulary, log_pos, log_neg)
+
+    @classmethod
+    def open(cls, path):
+
+        """Open a model artifact, memory mapping its arrays
+        Args:
+            path (str): Location of the artifact.
+        Returns:
+            Model: The model in the artifact
+        """
+
+        with open(os.path.join(path, 'vocabulary.txt'), 'r') as fp:
+            words = fp.read().split('\n')
+        return cls({word: i + 1 for i, word in enumerate(words)},
+                   np.load(os.path.join(path, 'log_pos.npy'), mmap_mode='r'),
+                   np.load(os.path.join(path, 'log_neg.npy'), mmap_mode='r'))
+
+    def save(self, path, meta):
+
+        """Write the model to an artifact
+        Args:
+            path (str): Location of the artifact.
+            meta (dict): Describes what the model was built from. Written last, so a partly written artifact is never used.
+        """
+
+        os.makedirs(path, exist_ok=True)
+        words = sorted(self.vocabulary, key=self.vocabulary.get)
+        # A list rather than a dict, as the order of a dict isn't kept before Python 3.6
+        files = [('vocabulary.txt', lambda fp: fp.write('\n'.join(words).encode('utf-8'))),
+                 ('log_pos.npy', lambda fp: np.save(fp, np.asarray(self.log_pos, dtype='<f8'))),
+                 ('log_neg.npy', lambda fp: np.save(fp, np.asarray(self.log_neg, dtype='<f8'))),
+                 ('meta.json', lambda fp: fp.write(json.dumps(meta).encode('utf-8')))]
+        for name, write in files:
+            with open(os.path.join(path, name + '.tmp'), 'wb') as fp:
+                write(fp)
+            os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+
+    def score_batch(self, texts):
+
+        """Generate the sentiment of each of `texts` using Bayes' Theorum.
+        Args:
+            texts (list): Texts from which the sentiment will be calculated.
+        Returns:
+            ndarray: Sentiment of each text in `texts`
+        """
+
+        words = [text.split(' ') for text in texts]
+        lengths = [len(text) for text in words]
+        ids = np.fromiter((self.vocabulary.get(word, 0) for text in words for word in text),
+                          dtype=np.intp, count=sum(lengths))
+        owners = np.repeat(np.arange(len(texts)), lengths)
+        log_pos = np.log(0.5) + np.bincount(owners, weights=self.log_pos[ids], minlength=len(texts))
+        log_neg = np.log(0.5) + np.bincount(owners, weights=self.log_neg[ids], minlength=len(texts))
+        # p_pos / (p_pos + p_neg) without leaving log space
+        return np.round(0.5 * (1 + np.tanh((log_pos - log_neg) / 2)), 4)
+
+    def score(self, text):
+
+        """Generate the sentiment of 'text' using Bayes' Theorum.
+        Args:
+            text (str): Text from which the sentiment will be calculated.
+        Returns:
+            float: Sentiment of `text`
+        """
+
+        return float(self.score_batch([text])[0])
+
+
+def digest():
+
+    """Fingerprint the corpora so that a model built from older corpora can be detected
+    Returns:
+        dict: SHA-1 of each corpus, by file name
+    """
+
+    digests = {}
+    for corpus in CORPORA:
+        with open(corpus, 'rb') as fp:
+            digests[os.path.basename(corpus)] = hashlib.sha1(fp.read()).hexdigest()
+    return digests
+
+
+def build(path=MODEL_DIR):
+
+    """Compile the classifier from the corpora into a model artifact
+    Args:
+        path (str, optional): Location of the artifact.
+    Returns:
+        Model: The compiled model
+    """
+
+    model = Model.compile(generate(CORPORA[0], lexicon()), generate(CORPORA[1], lexicon()))
+    model.save(path, {'version': VERSION, 'corpora': digest()})
+    return model
+
+
+def load(path=MODEL_DIR):
+
+    """Load the model artifact, rebuilding it first if it is missing or the corpora have changed
+    Args:
+        path (str, optional): Location of the artifact.
+    Returns:
+        Model: The compiled model
+    """
+
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as fp:
+            meta = json.load(fp)
+    except (IOError, ValueError):
+        meta = {}
+    if meta.get('version') != VERSION or meta.get('corpora') != digest():
+        build(path)
+    return Model.open(path)
+
+
+if __name__ == '__main__':
+    print('Building the sentiment model')
+    build()
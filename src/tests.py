@@ -1,12 +1,186 @@
 """Tests for updateDB.py and associated files.
 """
 from django.test import TestCase
-from relationships.models import Story, Node, Edge, Sentiment
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from relationships.models import Snapshot, Story, Node, Edge, Sentiment, Alias
 from sentiment import naivebayes
 import updateDB
+import pipeline
 import praw
 from wikiapi import WikiApi
 from django.utils import timezone
+import datetime
+from prawcore.exceptions import ResponseException
+from unittest import mock
+from praw.models import MoreComments
+from django.core.management import call_command
+import io
+import os
+import tempfile
+import subprocess
+import sys
+import json
+import numpy
+import threading
+import queue
+import multiprocessing
+import signal
+import time
+from collections import Counter
+
+
+class FakeComment(object):
+
+    """Stand-in for a reddit comment
+
+    Attributes:
+        body (str): The text of the comment
+        replies (list): The replies to the comment
+    """
+
+    def __init__(self, body, replies=()):
+        self.body = body
+        self.replies = list(replies)
+
+
+class FakeMoreComments(MoreComments):
+
+    """Stand-in for a placeholder for more reddit comments
+
+    Attributes:
+        calls (int): Number of times the comments have been fetched
+        fetched (list): The comments behind the placeholder
+    """
+
+    def __init__(self, comments):
+        self.fetched = comments
+        self.calls = 0
+
+    def comments(self, update=True):
+        self.calls += 1
+        return self.fetched
+
+
+class FakeSubmission(object):
+
+    """Stand-in for a reddit submission
+
+    Attributes:
+        comments (list): The top level comments of the submission
+        id (str): The ID of the submission
+        title (str): The title of the submission
+        url (str): The URL the submission links to
+    """
+
+    def __init__(self, id, title, comments):
+        self.id = id
+        self.title = title
+        self.url = 'https://example.com/' + id
+        self.comments = [FakeComment(body) for body in comments]
+
+
+class FakeSubreddit(object):
+
+    """Stand-in for a subreddit
+
+    Attributes:
+        submissions (list): The submissions in the subreddit
+    """
+
+    def __init__(self, submissions):
+        self.submissions = submissions
+
+    def top(self, limit=100):
+        return iter(self.submissions[:limit])
+
+    def hot(self, limit=100):
+        return iter(self.submissions[::-1][:limit])
+
+
+class FakeArticle(object):
+
+    """Stand-in for a Wikipedia article
+
+    Attributes:
+        heading (str): The heading of the article
+    """
+
+    def __init__(self, heading):
+        self.heading = heading
+
+
+def signalSelf():
+
+    """Sends SIGTERM to the calling process, as a pool worker would get it with the rest of its group
+
+    Returns:
+        str: `survived` if the process is still running afterwards
+    """
+
+    os.kill(os.getpid(), signal.SIGTERM)
+    time.sleep(0.1)
+    return 'survived'
+
+
+class FakeWiki(object):
+
+    """Local stand-in for `WikiApi`
+
+    Attributes:
+        articles (dict): Headings of the known articles, by search term
+        calls (int): Number of searches made
+    """
+
+    def __init__(self, articles):
+        self.articles = articles
+        self.calls = 0
+
+    def find(self, term):
+        self.calls += 1
+        return [term] if term in self.articles else []
+
+    def get_article(self, title):
+        return FakeArticle(self.articles[title])
+
+
+class FakeTree(object):
+
+    """Stand-in for a reddit submission with a tree of comments
+
+    Attributes:
+        comments (list): The top level comments of the submission
+        more (obj): Placeholder for the comments that haven't been fetched
+    """
+
+    def __init__(self):
+        good = 'That was amazing. I loved it.'
+        bad = 'That was terrible. I hated it.'
+        self.more = FakeMoreComments([FakeComment(bad, [FakeComment(bad)])])
+        self.comments = [FakeComment(good, [FakeComment(good, [FakeComment(good)]), FakeComment(bad)]),
+                         FakeComment(bad),
+                         self.more]
+
+
+class FakeReddit(object):
+
+    """Local stand-in for `praw.Reddit`
+
+    Attributes:
+        calls (int): Number of submissions that have been fetched
+        submissions (dict): The submissions known to the client, by ID
+    """
+
+    def __init__(self, submissions):
+        self.submissions = {submission.id: submission for submission in submissions}
+        self.calls = 0
+
+    def subreddit(self, name):
+        return FakeSubreddit(list(self.submissions.values()))
+
+    def submission(self, id):
+        self.calls += 1
+        return self.submissions[id]
 
 
 class SentimentTestCase(TestCase):
@@ -34,6 +208,50 @@ class SentimentTestCase(TestCase):
         self.assertTrue(naivebayes.sentiment('That was terrible. I hated it.', self.pos_lex, self.neg_lex) < 0.5)
         self.assertTrue(naivebayes.sentiment('That was amazing. I loved it.', self.pos_lex, self.neg_lex) > 0.5)
 
+    def test_model_matches_sentiment(self):
+
+        """Test that the compiled model scores texts the same as `sentiment`
+        """
+
+        model = naivebayes.Model.compile(self.pos_lex, self.neg_lex)
+        texts = ['That was terrible. I hated it.', 'That was amazing. I loved it.', '', 'the unknownword',
+                 'a moving and funny film , but the plot is thin']
+        scores = model.score_batch(texts)
+        self.assertEqual(len(scores), len(texts))
+        for text, score in zip(texts, scores):
+            self.assertAlmostEqual(score, naivebayes.sentiment(text, self.pos_lex, self.neg_lex), places=4)
+
+    def test_model_artifact(self):
+
+        """Test that the model artifact is rebuilt when the corpora change and loads the same model
+        """
+
+        with tempfile.TemporaryDirectory() as path:
+            naivebayes.load(path)
+            with open(os.path.join(path, 'meta.json'), 'r') as fp:
+                meta = json.load(fp)
+            self.assertEqual(meta['corpora'], naivebayes.digest())
+            meta['corpora']['pos.txt'] = 'outdated'
+            with open(os.path.join(path, 'meta.json'), 'w') as fp:
+                json.dump(meta, fp)
+            model = naivebayes.load(path)
+            with open(os.path.join(path, 'meta.json'), 'r') as fp:
+                self.assertEqual(json.load(fp)['corpora'], naivebayes.digest())
+            texts = ['That was terrible. I hated it.', 'That was amazing. I loved it.', '']
+            compiled = naivebayes.Model.compile(self.pos_lex, self.neg_lex)
+            self.assertEqual(list(model.score_batch(texts)), list(compiled.score_batch(texts)))
+            self.assertIsInstance(model.log_pos, numpy.memmap)
+
+    def test_model_long_text(self):
+
+        """Test that long texts don't underflow to a neutral sentiment
+        """
+
+        model = naivebayes.Model.compile(self.pos_lex, self.neg_lex)
+        text = ' '.join(['terrible boring awful mess'] * 200)
+        self.assertEqual(naivebayes.sentiment(text, self.pos_lex, self.neg_lex), 0.5)
+        self.assertTrue(model.score(text) < 0.5)
+
 
 class RedditTestCase(TestCase):
 
@@ -60,6 +278,31 @@ class RedditTestCase(TestCase):
         submission = self.r.submission('5nbxbh')
         self.assertEqual(submission.title, '"Leave the internet and come play with me."')
 
+    def test_clients_lent(self):
+
+        """Test that reddit clients are only lent to one thread at a time, and are reused by later threads
+        """
+
+        with mock.patch.object(updateDB, '_clients', queue.LifoQueue()), \
+                mock.patch('updateDB.getReddit', side_effect=object) as create:
+            with updateDB.redditClient() as first:
+                with updateDB.redditClient() as second:
+                    self.assertIsNot(first, second)
+            lent = []
+
+            def use():
+                with updateDB.redditClient() as client:
+                    lent.append(client)
+
+            for i in range(3):
+                thread = threading.Thread(target=use)
+                thread.start()
+                thread.join()
+            self.assertEqual(create.call_count, 2)
+            self.assertTrue(all(client in (first, second) for client in lent))
+            with updateDB.redditClient(self.r) as client:
+                self.assertIs(client, self.r)
+
 
 class UpdateDBFunctionTests(TestCase):
 
@@ -130,13 +373,87 @@ class UpdateDBFunctionTests(TestCase):
                 entities.append(kw)
         self.assertEqual(entities, self.test_sentence_with_entities_nodes)
 
+    def test_keywords_batch(self):
+
+        """Test that extracting keywords with a pool of processes matches extracting them one at a time
+        """
+
+        texts = [self.test_sentence, self.test_sentence_with_entities, 'Mr Johnson has got a new cat called Dave'] * 5
+        expected = [list(updateDB.keywords(text)) for text in texts]
+        self.assertEqual(updateDB.keywords_batch(texts, processes=2, chunksize=4), expected)
+        self.assertEqual(updateDB.keywords_batch(texts, processes=1), expected)
+        self.assertEqual(expected[1], self.test_sentence_with_entities_nodes)
+
     def test_make_edges(self):
 
         """Tests that edges between nodes can be correctly created
         """
 
-        updateDB.makeEdges([self.node1, self.node2, self.node3], self.story)
+        nodes = [self.node1, self.node2, self.node3]
+        with self.assertNumQueries(2):
+            updateDB.makeEdges(nodes, self.story)
         self.assertEqual(len(Edge.objects.all()), 3)
+        self.assertEqual(nodes, [self.node1, self.node2, self.node3])
+
+    def test_make_edges_weighted(self):
+
+        """Tests that edges seen again are weighted rather than duplicated
+        """
+
+        updateDB.makeEdges([self.node1, self.node2], 'http://example.com/1')
+        updateDB.makeEdges([self.node3, self.node2, self.node1, self.node2], 'http://example.com/2')
+        self.assertEqual(Edge.objects.count(), 3)
+        edge = Edge.objects.get(origin=self.node1, destination=self.node2)
+        self.assertEqual(edge.weight, 2)
+        self.assertEqual(edge.source, 'http://example.com/2')
+        self.assertTrue(edge.lastSeen > edge.date)
+        self.assertEqual(Edge.objects.get(origin=self.node2, destination=self.node3).weight, 1)
+
+    def test_add_story_statement_budget(self):
+
+        """Tests that adding a story issues a bounded number of statements
+        """
+
+        headings = ['Entity ' + str(i) for i in range(10)] + [None]
+        with CaptureQueriesContext(connection) as queries:
+            updateDB.addStory(('https://example.com/story/budget', 'Ten entities', 0.5), headings=headings)
+        # The number of statements doesn't grow with the number of entities
+        self.assertLessEqual(len(queries), 12)
+        self.assertEqual(Sentiment.objects.count(), 10)
+        self.assertEqual(Edge.objects.count(), 45)
+        node = Node.objects.get(name='Entity 0')
+        self.assertEqual(node.sentimentCount, 1)
+        self.assertEqual(node.sentiment(), 0.5)
+
+    def test_node_registry(self):
+
+        """Tests that the registry creates missing nodes together and refreshes dates when flushed
+        """
+
+        registry = updateDB.NodeRegistry()
+        with self.assertNumQueries(2):
+            ids = registry.get(['Key word 1', 'New 1', 'New 2', 'New 1'], self.story)
+        self.assertEqual(ids[0], self.node1.pk)
+        self.assertEqual(ids[1], ids[3])
+        with self.assertNumQueries(0):
+            registry.get(['New 2'], self.story)
+        with self.assertNumQueries(1):
+            registry.flush()
+        self.assertTrue(Node.objects.get(pk=self.node1.pk).date > self.node1.date)
+        self.assertEqual(Node.objects.get(pk=self.node2.pk).date, self.node2.date)
+
+    def test_node_registry_many(self):
+
+        """Tests that loading and flushing many nodes stays under the SQL variable limit of SQLite
+        """
+
+        names = ['Node ' + str(i) for i in range(1200)]
+        registry = updateDB.NodeRegistry()
+        registry.get(names, self.story)
+        with self.assertNumQueries(3):
+            registry.flush()
+        with self.assertNumQueries(3):
+            self.assertEqual(len(updateDB.NodeRegistry(names).ids), 1200)
 
     def test_add_story(self):
 
@@ -146,3 +463,358 @@ class UpdateDBFunctionTests(TestCase):
         updateDB.addStory(('https://example.com/story/url', 'Mr Johnson has got a new cat called Dave', 0.8))
         self.assertEqual(len(Node.objects.filter(name='Dave')), 1)
         self.assertEqual(len(Story.objects.filter(source='https://example.com/story/url')), 1)
+
+
+class StoriesTestCase(TestCase):
+
+    """Test the fetching of stories against a local stand-in for reddit
+
+    Attributes:
+        reddit (obj): Local stand-in for the reddit client
+    """
+
+    def setUp(self):
+
+        """Set up the fake reddit client
+        """
+
+        self.reddit = FakeReddit([FakeSubmission('a', 'Good news', ['That was amazing. I loved it.']),
+                                  FakeSubmission('b', 'Bad news', ['That was terrible. I hated it.']),
+                                  FakeSubmission('c', 'No news', [])])
+
+    def test_concurrent_stories_match_serial(self):
+
+        """Test that fetching concurrently yields the same stories in the same order
+        """
+
+        serial = list(updateDB.stories(reddit=self.reddit, workers=1))
+        concurrent = list(updateDB.stories(reddit=self.reddit, workers=4))
+        self.assertEqual(serial, concurrent)
+        self.assertEqual(len(concurrent), 3)
+        self.assertEqual(concurrent[0][:2], ('https://example.com/a', 'Good news'))
+        self.assertTrue(concurrent[0][2] > 0.5)
+        self.assertTrue(concurrent[1][2] < 0.5)
+        self.assertEqual(concurrent[2][2], 0.5)
+
+    def test_existing_stories_skipped(self):
+
+        """Test that stories already in the database are skipped before their comments are fetched
+        """
+
+        Story(source='https://example.com/a', content='Good news').save()
+        stats = Counter()
+        with self.assertNumQueries(1):
+            fetched = list(updateDB.stories(reddit=self.reddit, stats=stats))
+        self.assertEqual([story[0] for story in fetched], ['https://example.com/b', 'https://example.com/c'])
+        self.assertEqual(self.reddit.calls, 2)
+        self.assertEqual(stats['skipped'], 10)
+
+    def test_tree_sentiment(self):
+
+        """Test that the whole comment tree is scored, including placeholders for more comments
+        """
+
+        tree = FakeTree()
+        self.reddit.submissions['tree'] = tree
+        score, n = updateDB.tree_sentiment('tree', self.reddit)
+        self.assertEqual(n, 7)
+        self.assertEqual(tree.more.calls, 1)
+        pages = list(updateDB.comment_pages(FakeTree()))
+        self.assertEqual([len(page) for page in pages], [2, 3, 2])
+        model = updateDB.getModel()
+        bodies = [body for page in pages for body in page]
+        self.assertAlmostEqual(score, sum(model.score(body) for body in bodies) / 7)
+
+    def test_tree_sentiment_budget(self):
+
+        """Test that the comment tree is only read within the budget
+        """
+
+        tree = FakeTree()
+        self.reddit.submissions['tree'] = tree
+        score, n = updateDB.tree_sentiment('tree', self.reddit, updateDB.Budget(comments=2, calls=10, seconds=30))
+        self.assertEqual(n, 2)
+        self.assertEqual(tree.more.calls, 0)
+        score, n = updateDB.tree_sentiment('tree', self.reddit, updateDB.Budget(comments=100, calls=1, seconds=30))
+        self.assertEqual(n, 5)
+        self.assertEqual(tree.more.calls, 0)
+
+    def test_sampled_sentiment(self):
+
+        """Test that sampling stops once the estimate is confident enough
+        """
+
+        tree = FakeTree()
+        self.reddit.submissions['tree'] = tree
+        score, interval, n = updateDB.sampled_sentiment('tree', self.reddit, width=2.0, minimum=2)
+        self.assertEqual(n, 2)
+        self.assertEqual(tree.more.calls, 0)
+        self.assertTrue(interval[0] <= score <= interval[1])
+        score, interval, n = updateDB.sampled_sentiment('tree', self.reddit, width=0.0)
+        self.assertEqual(n, 7)
+        self.assertAlmostEqual(score, updateDB.tree_sentiment('tree', self.reddit)[0])
+        self.assertTrue(interval[1] - interval[0] > 0)
+
+    def test_backoff_when_rate_limited(self):
+
+        """Test that rate limited requests are retried and other errors are not
+        """
+
+        response = mock.Mock(status_code=429, headers={})
+        func = mock.Mock(side_effect=[ResponseException(response), 'done'])
+        with mock.patch('updateDB.time.sleep') as sleep:
+            self.assertEqual(updateDB.backoff(func), 'done')
+        self.assertEqual(sleep.call_count, 1)
+        func = mock.Mock(side_effect=ResponseException(mock.Mock(status_code=404, headers={})))
+        with self.assertRaises(ResponseException):
+            updateDB.backoff(func)
+        self.assertEqual(func.call_count, 1)
+
+
+class ResolveTestCase(TestCase):
+
+    """Test the caching of keyword lookups on Wikipedia
+
+    Attributes:
+        wiki (obj): Local stand-in for the Wikipedia API
+    """
+
+    def setUp(self):
+
+        """Set up the fake Wikipedia client
+        """
+
+        self.wiki = FakeWiki({'Trump': 'Donald Trump', 'EU': 'European Union'})
+
+    def test_resolve_cached(self):
+
+        """Test that known and unknown keywords are only looked up once
+        """
+
+        hits = updateDB.cache_stats['hits']
+        for i in range(3):
+            self.assertEqual(updateDB.resolve('Trump', self.wiki), 'Donald Trump')
+            self.assertIsNone(updateDB.resolve('Nobody', self.wiki))
+        self.assertEqual(self.wiki.calls, 2)
+        self.assertEqual(updateDB.cache_stats['hits'] - hits, 4)
+        self.assertEqual(Alias.objects.get(keyword='Nobody').heading, None)
+
+    def test_resolve_expired(self):
+
+        """Test that expired keywords are looked up again
+        """
+
+        Alias(keyword='EU', heading='Europe', date=timezone.now() - datetime.timedelta(days=365)).save()
+        self.assertEqual(updateDB.resolve('EU', self.wiki), 'European Union')
+        self.assertEqual(self.wiki.calls, 1)
+        self.assertEqual(Alias.objects.get(keyword='EU').heading, 'European Union')
+
+    def test_resolve_in_flight(self):
+
+        """Test that a keyword being looked up by one thread isn't looked up again by another
+        """
+
+        cache = updateDB.AliasCache()
+        started, finish = threading.Event(), threading.Event()
+        find = self.wiki.find
+
+        def slowFind(term):
+            if term == 'Trump':
+                started.set()
+                finish.wait(5)
+            return find(term)
+
+        self.wiki.find = slowFind
+        results = {}
+        first = threading.Thread(target=lambda: results.update(first=cache.resolve(['Trump'], self.wiki)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.update(second=cache.resolve(['Trump', 'EU'], self.wiki)))
+        second.start()
+        # Wait for the second thread to look up the keyword that isn't in flight
+        while self.wiki.calls < 1:
+            second.join(0.01)
+        finish.set()
+        first.join()
+        second.join()
+        self.assertEqual(self.wiki.calls, 2)
+        self.assertEqual(results['second'], {'Trump': 'Donald Trump', 'EU': 'European Union'})
+        self.assertEqual(cache.inflight, {})
+
+    def test_add_stories_shares_lookups(self):
+
+        """Test that keywords shared between a batch of stories are only looked up once
+        """
+
+        batch = [('https://example.com/1', 'Trump meets EU leaders in Brussels', 0.2),
+                 ('https://example.com/2', 'EU fines Google', 0.4),
+                 ('https://example.com/3', 'Trump criticises Google', 0.6)]
+        kws = [kw for story in batch for kw in updateDB.cleanKeywords(story[1])]
+        updateDB.addStories(batch, wikipedia=self.wiki, workers=4)
+        self.assertEqual(self.wiki.calls, len(set(kws)))
+        self.assertTrue(self.wiki.calls < len(kws))
+        self.assertEqual(Node.objects.filter(name='European Union').count(), 1)
+        self.assertEqual(Story.objects.count(), 3)
+
+
+class PipelineTestCase(TestCase):
+
+    """Test the staged ingestion pipeline
+    """
+
+    def test_pipeline_results(self):
+
+        """Test that every item passes through every stage and that the queues stay bounded
+        """
+
+        stages = [pipeline.Stage('double', lambda x: x * 2, workers=3),
+                  pipeline.Stage('odd', lambda x: x + 1 if x % 4 else None, workers=2, size=1)]
+        results = pipeline.run(stages, range(100))
+        self.assertEqual(sorted(results), [x * 2 + 1 for x in range(100) if x % 2])
+        self.assertEqual([stage.items for stage in stages], [100, 100])
+        self.assertLessEqual(stages[1].depth, 1)
+
+    def test_pipeline_inline_stage(self):
+
+        """Test that a stage without workers runs in the calling thread
+        """
+
+        written = []
+        stages = [pipeline.Stage('double', lambda x: x * 2, workers=2),
+                  pipeline.Stage('write', lambda x: written.append(threading.current_thread()), workers=0)]
+        pipeline.run(stages, range(10))
+        self.assertEqual(written, [threading.current_thread()] * 10)
+
+    def test_pipeline_error(self):
+
+        """Test that an error in a stage stops the pipeline and is raised
+        """
+
+        stages = [pipeline.Stage('invert', lambda x: 1 / x, workers=2)]
+        with self.assertRaises(ZeroDivisionError):
+            pipeline.run(stages, range(100))
+
+    def test_keywords_batch_error(self):
+
+        """Test that an error loading the NLP models is raised rather than the pool waiting forever
+        """
+
+        # The worker processes are forked, so they are patched too
+        with mock.patch('updateDB.keywords', side_effect=LookupError('tagger')):
+            with self.assertRaises(LookupError):
+                updateDB.keywords_batch(['Trump visits London'] * 4, processes=2)
+
+    def test_keyword_worker_sigterm(self):
+
+        """Test that a keyword extraction process finishes its task when its process group is sent SIGTERM
+        """
+
+        pool = multiprocessing.Pool(1, initializer=updateDB._startWorker)
+        try:
+            self.assertEqual(pool.apply_async(signalSelf).get(5), 'survived')
+        finally:
+            updateDB._stopPool(pool)
+
+    def test_update_db(self):
+
+        """Test that the pipeline adds new stories from reddit to the database
+        """
+
+        reddit = FakeReddit([FakeSubmission('a', 'Trump visits London', ['That was amazing. I loved it.']),
+                             FakeSubmission('b', 'London mayor criticises Trump', [])])
+        wiki = FakeWiki({'Trump': 'Donald Trump', 'London': 'London'})
+        updateDB.updateDB(reddit=reddit, wikipedia=wiki)
+        self.assertEqual(Story.objects.filter(source__startswith='https://example.com/').count(), 2)
+        self.assertEqual(reddit.calls, 2)
+        self.assertEqual(Node.objects.get(name='Donald Trump').sentiment_collected_from.count(), 2)
+        self.assertEqual(Edge.objects.get().weight, 2)
+        self.assertIn(b'"Donald Trump"', bytes(Snapshot.objects.get().content))
+
+
+class IngestCommandTestCase(TestCase):
+
+    """Test the ingestion daemon
+
+    Attributes:
+        lock (str): Location of the lock file used by the tests
+    """
+
+    def setUp(self):
+
+        """Pick a lock file for the test
+        """
+
+        fd, self.lock = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+
+        """Remove the lock file
+        """
+
+        os.remove(self.lock)
+
+    def test_lock(self):
+
+        """Test that only one run can hold the lock at once
+        """
+
+        with updateDB.lock(self.lock) as first:
+            with updateDB.lock(self.lock) as second:
+                self.assertTrue(first)
+                self.assertFalse(second)
+        with updateDB.lock(self.lock) as third:
+            self.assertTrue(third)
+
+    def test_ingest_once(self):
+
+        """Test that the command runs an update, unless one is already running
+        """
+
+        with mock.patch('updateDB.updateDB') as update:
+            call_command('ingest', once=True, lock=self.lock, stdout=io.StringIO())
+            self.assertEqual(update.call_count, 1)
+            stderr = io.StringIO()
+            with updateDB.lock(self.lock):
+                call_command('ingest', once=True, lock=self.lock, stdout=io.StringIO(), stderr=stderr)
+            self.assertEqual(update.call_count, 1)
+            self.assertIn('already running', stderr.getvalue())
+
+    def test_ingest_interval(self):
+
+        """Test that the wait between runs is counted from the start of the run
+        """
+
+        with mock.patch('updateDB.updateDB'), \
+                mock.patch('time.time', side_effect=[100.0, 110.0]), \
+                mock.patch('threading.Event.wait', side_effect=KeyboardInterrupt) as wait:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('ingest', interval=60, lock=self.lock, stdout=io.StringIO())
+        wait.assert_called_once_with(50.0)
+
+
+class ImportTestCase(TestCase):
+
+    """Test that importing updateDB stays cheap
+
+    Attributes:
+        BUDGET (float): Most seconds that importing updateDB may take
+    """
+
+    BUDGET = 1.0
+
+    def test_import_time(self):
+
+        """Test that importing updateDB is quick and doesn't load the clients, models or NLP libraries
+        """
+
+        code = ('import sys, time\n'
+                'start = time.time()\n'
+                'import updateDB\n'
+                'print(time.time() - start)\n'
+                'print(",".join(m for m in ("nltk", "praw", "wikiapi", "numpy") if m in sys.modules))\n')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         universal_newlines=True).split('\n')
+        self.assertLess(float(output[0]), self.BUDGET)
+        self.assertEqual(output[1], '')
@@ -1,79 +1,412 @@
 """Generates the contents of the database from reddit submissions.
 
+The reddit and Wikipedia clients, the sentiment model and the NLP libraries are only
+loaded when they are first needed, so importing this module stays cheap.
+
 Attributes:
-    neg_lex (dict): Lexicon of negative sentiment and relative frequencies.
-    pos_lex (dict): Lexicon of negative sentiment and relative frequencies.
-    r (obj): Object used to interact with reddit. See https://pypi.python.org/pypi/praw
+    cache_stats (Counter): Number of `hits` and `misses` of the keyword cache.
+    SUBREDDITS (list): Subreddits that stories are collected from.
+    WORKERS (int): Default number of submissions fetched from reddit, or keywords looked up on Wikipedia, at once.
+    CHUNKSIZE (int): Default number of texts sent to a keyword extraction process at once.
+    STAGE_WORKERS (dict): Default number of worker threads for each stage of the ingestion pipeline. The
+        keywords stage has a thread for each process of `getPool()`, which the threads hand their stories to.
+    BUDGET (Budget): Default limits on how much of a comment tree is read to score a submission.
+    SAMPLE_WIDTH (float): Default width of the 95% confidence interval at which sampling comments stops.
+    SAMPLE_MINIMUM (int): Default least number of comments sampled before sampling can stop.
 """
 
 import os
+import atexit
+import time
+import itertools
+import functools
+import multiprocessing
+import contextlib
+import queue
+import fcntl
+import signal
+import threading
 import django
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
-import nltk
-import praw
-from sentiment import naivebayes
-from praw.models import MoreComments
-from tqdm import tqdm
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import Counter
+import collections
+import pipeline
 import string
-from wikiapi import WikiApi
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "newsgraph.settings")
 django.setup()
-from relationships.models import Story, Node, Edge, Sentiment
+from relationships.models import Story, Node, Edge, Sentiment, Alias
+
+SUBREDDITS = ['news', 'worldnews']
+WORKERS = 8
+CHUNKSIZE = 64
+STAGE_WORKERS = {'sentiment': 8, 'keywords': os.cpu_count() or 1, 'resolve': 8}
+Budget = collections.namedtuple('Budget', ['comments', 'calls', 'seconds'])
+BUDGET = Budget(comments=500, calls=10, seconds=30)
+SAMPLE_WIDTH = 0.1
+SAMPLE_MINIMUM = 20
+cache_stats = Counter()
+_cache_stats_lock = threading.Lock()
+_clients = queue.LifoQueue()
+
+
+def getReddit():
+
+    """Creates a reddit client.
+
+    Returns:
+        obj: Object used to interact with reddit. See https://pypi.python.org/pypi/praw
+    """
+
+    import praw
+    return praw.Reddit(client_id='l-Gz5blkt7GCUg',
+                       client_secret='_xLEgNing89k6__sWItU1_j9aR8',
+                       user_agent='testscript by /u/pbexe')
+
+
+@contextlib.contextmanager
+def redditClient(reddit=None):
+
+    """Lends the calling thread one of the reddit clients kept by this process.
+
+    PRAW clients can't be shared between threads, so a client is only lent to one thread at a
+    time. A client is only created when all of them are lent out, so there are as many as the
+    most threads that have used them at once, and they are kept between ingestion runs.
+
+    Args:
+        reddit (obj, optional): Client to use instead, which is yielded as it is.
+
+    Yields:
+        obj: Object used to interact with reddit. See https://pypi.python.org/pypi/praw
+    """
+
+    if reddit is not None:
+        yield reddit
+        return
+    try:
+        client = _clients.get_nowait()
+    except queue.Empty:
+        client = getReddit()
+    try:
+        yield client
+    finally:
+        _clients.put(client)
+
+
+@functools.lru_cache(maxsize=None)
+def getWiki():
+
+    """Creates the Wikipedia client the first time it is needed.
+
+    Returns:
+        obj: Object used to interact with the Wikipedia API.
+    """
+
+    from wikiapi import WikiApi
+    return WikiApi()
+
+
+@functools.lru_cache(maxsize=None)
+def getModel():
+
+    """Loads the sentiment model the first time it is needed.
+
+    Returns:
+        obj: Sentiment classifier, loaded from its compiled artifact.
+    """
 
+    from sentiment import naivebayes
+    return naivebayes.load()
 
-wiki = WikiApi()
-pos_lex = naivebayes.generate('sentiment/pos.txt', naivebayes.lexicon())
-neg_lex = naivebayes.generate('sentiment/neg.txt', naivebayes.lexicon())
-r = praw.Reddit(client_id='l-Gz5blkt7GCUg',
-                client_secret='_xLEgNing89k6__sWItU1_j9aR8',
-                user_agent='testscript by /u/pbexe')
 
+def backoff(func, *args, retries=5, delay=1):
 
-def submission_sentiment(id):
+    """Call `func`, backing off exponentially while reddit is rate limiting or failing.
+
+    Args:
+        func (function): The function making the requests to reddit.
+        *args: Arguments passed to `func`.
+        retries (int, optional): Number of attempts before giving up.
+        delay (int, optional): Seconds to wait after the first failure. Doubles after each attempt.
+
+    Returns:
+        obj: Whatever `func` returns
+
+    Raises:
+        RequestException: The request still failed after `retries` attempts.
+        ResponseException: Reddit responded with an error that retrying won't fix.
+    """
+
+    from prawcore.exceptions import RequestException, ResponseException
+    for attempt in range(retries):
+        try:
+            return func(*args)
+        except (RequestException, ResponseException) as e:
+            response = getattr(e, 'response', None)
+            status = getattr(response, 'status_code', 500)
+            if attempt == retries - 1 or (status != 429 and status < 500):
+                raise
+            wait = delay * 2 ** attempt
+            # Reddit tells us how long to wait when it rate limits us
+            retry_after = getattr(response, 'headers', {}).get('retry-after')
+            if retry_after is not None and retry_after.isdigit():
+                wait = max(wait, int(retry_after))
+            time.sleep(wait)
+
+
+def submission_sentiment(id, reddit=None):
 
     """Generate sentiment of specified reddit article.
 
     Args:
         id (int): Description
+        reddit (obj, optional): Reddit client to fetch the comments with. Defaults to one lent by `redditClient`.
 
     Returns:
         float: Average sentiment of the article
     """
 
-    total = 0
+    from praw.models import MoreComments
+    with redditClient(reddit) as client:
+        comments = list(client.submission(id).comments)
+    # Placeholders for more comments count towards the average but aren't scored
+    bodies = [comment.body for comment in comments if not isinstance(comment, MoreComments)]
+    n = len(comments)
+    return float(getModel().score_batch(bodies).sum()) / n if n != 0 else 0.5
+
+
+def comment_pages(submission, budget=BUDGET, workers=WORKERS, reddit=None):
+
+    """Yields the comments of `submission` a page at a time, breadth first.
+
+    Each page is the comments a level further down the tree than the last. Placeholders for more
+    comments are expanded concurrently, until the budget of API calls or time runs out.
+
+    Args:
+        submission (obj): The submission whose comments are read.
+        budget (Budget, optional): Most comments read, API calls made and seconds spent on `submission`.
+        workers (int, optional): Maximum number of placeholders expanded at once.
+        reddit (obj, optional): Reddit client `submission` was fetched with. If not given, each thread
+            expanding placeholders is lent a client by `redditClient`.
+
+    Returns:
+        list: The bodies of the comments on the next page
+    """
+
+    from praw.models import MoreComments
+
+    def expand(placeholder):
+        if reddit is not None:
+            return backoff(placeholder.comments)
+        with redditClient() as client:
+            # Placeholders make their requests through the client they were created by
+            placeholder._reddit = client
+            return backoff(placeholder.comments)
+
+    deadline = time.time() + budget.seconds
+    # Fetching the submission's comments is the first call
+    page = list(submission.comments)
+    calls = 1
+    read = 0
+    while len(page) > 0 and read < budget.comments and time.time() < deadline:
+        bodies = []
+        following = []
+        more = []
+        for comment in page:
+            if isinstance(comment, MoreComments):
+                more.append(comment)
+            else:
+                bodies.append(comment.body)
+                following += list(comment.replies)
+        bodies = bodies[:budget.comments - read]
+        read += len(bodies)
+        if len(bodies) > 0:
+            yield bodies
+        more = more[:max(budget.calls - calls, 0)]
+        calls += len(more)
+        if len(more) > 0 and read < budget.comments and time.time() < deadline:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for comments in pool.map(expand, more):
+                    following += list(comments)
+        page = following
+
+
+def tree_sentiment(id, reddit=None, budget=BUDGET):
+
+    """Generate sentiment of specified reddit article from its whole comment tree.
+
+    Args:
+        id (int): ID of the submission
+        reddit (obj, optional): Reddit client to fetch the comments with. Defaults to one lent by `redditClient`.
+        budget (Budget, optional): Most comments read, API calls made and seconds spent on the article.
+
+    Returns:
+        tuple: Average sentiment of the article and the number of comments it was taken from
+    """
+
+    total = 0.0
+    n = 0
+    with redditClient(reddit) as client:
+        for bodies in comment_pages(client.submission(id), budget, reddit=reddit):
+            total += float(getModel().score_batch(bodies).sum())
+            n += len(bodies)
+    return (total / n if n != 0 else 0.5, n)
+
+
+def sampled_sentiment(id, reddit=None, width=SAMPLE_WIDTH, minimum=SAMPLE_MINIMUM, budget=BUDGET):
+
+    """Estimate sentiment of specified reddit article from as few comments as needed.
+
+    Comments are read in the same order as `tree_sentiment`, and reading stops once the 95%
+    confidence interval on their mean sentiment is narrower than `width`. Pages of comments
+    after that are never fetched.
+
+    Args:
+        id (int): ID of the submission
+        reddit (obj, optional): Reddit client to fetch the comments with. Defaults to one lent by `redditClient`.
+        width (float, optional): Width of the confidence interval at which to stop.
+        minimum (int, optional): Least number of comments read before stopping.
+        budget (Budget, optional): Most comments read, API calls made and seconds spent on the article.
+
+    Returns:
+        tuple: Estimated sentiment of the article, its confidence interval and the number of comments it was taken from
+    """
+
+    import numpy as np
     n = 0
-    submission = r.submission(id)
-    for top_level_comment in submission.comments:
-        n += 1
-        if isinstance(top_level_comment, MoreComments):
-            continue
-        total += naivebayes.sentiment(top_level_comment.body, pos_lex, neg_lex)
-    return total / n if n != 0 else 0.5
+    total = 0.0
+    squares = 0.0
+    with redditClient(reddit) as client:
+        for bodies in comment_pages(client.submission(id), budget, reddit=reddit):
+            scores = getModel().score_batch(bodies)
+            # Running mean and standard error after each comment on the page
+            counts = n + np.arange(1, len(scores) + 1)
+            sums = total + np.cumsum(scores)
+            sums_of_squares = squares + np.cumsum(scores ** 2)
+            means = sums / counts
+            variances = (sums_of_squares - counts * means ** 2) / np.maximum(counts - 1, 1)
+            widths = 2 * 1.96 * np.sqrt(np.maximum(variances, 0) / counts)
+            done = np.flatnonzero((counts >= max(minimum, 2)) & (widths <= width))
+            last = done[0] if len(done) > 0 else len(scores) - 1
+            n, total, squares = int(counts[last]), float(sums[last]), float(sums_of_squares[last])
+            if len(done) > 0:
+                break
+    if n < 2:
+        return (total / n if n != 0 else 0.5, (0.0, 1.0), n)
+    mean = total / n
+    half = 1.96 * (max(squares - n * mean ** 2, 0) / (n - 1) / n) ** 0.5
+    return (mean, (max(mean - half, 0.0), min(mean + half, 1.0)), n)
+
+
+def storySentiment(id, reddit=None, mode='top'):
+
+    """Generate sentiment of specified reddit article.
+
+    Args:
+        id (int): ID of the submission
+        reddit (obj, optional): Reddit client to fetch the comments with. Defaults to one lent by `redditClient`.
+        mode (str, optional): `top` to only read the top level comments, `tree` to read the whole comment
+            tree within `BUDGET`, or `sample` to read only as much of the tree as `sampled_sentiment` needs.
+
+    Returns:
+        float: Average sentiment of the article
+    """
+
+    if mode == 'tree':
+        return tree_sentiment(id, reddit)[0]
+    if mode == 'sample':
+        return sampled_sentiment(id, reddit)[0]
+    return submission_sentiment(id, reddit)
 
 
-def stories():
+def submissions(reddit=None, stats=None):
+
+    """Lists the top and hot submissions from the news and worldnews subreddits that aren't in the database yet.
+
+    Args:
+        reddit (obj, optional): Reddit client to fetch the submissions with. Defaults to one lent by `redditClient`.
+        stats (Counter, optional): Counts the number of `skipped` stories.
+
+    Returns:
+        list: The new submissions, in listing order
+    """
+
+    listed = []
+    with redditClient(reddit) as client:
+        for subreddit in SUBREDDITS:
+            listed += backoff(lambda: list(client.subreddit(subreddit).top(limit=100)))
+            listed += backoff(lambda: list(client.subreddit(subreddit).hot(limit=100)))
+    # Look up every story in the batch at once rather than one query per story
+    seen = set(Story.objects.filter(source__in=set(item.url for item in listed))
+                            .values_list('source', flat=True))
+    new = []
+    for item in listed:
+        if item.url not in seen:
+            seen.add(item.url)
+            new.append(item)
+    if stats is not None:
+        stats['skipped'] += len(listed) - len(new)
+    return new
+
+
+def stories(reddit=None, workers=WORKERS, stats=None, mode='top'):
 
     """Yields top and hot stories from the news and worldnews subreddits.
 
+    Stories that are already in the database are skipped before their comments
+    are fetched. The comments of the remaining submissions are fetched and scored
+    by a pool of `workers` threads, but the stories are still yielded in listing order.
+
+    Args:
+        reddit (obj, optional): Reddit client to fetch the stories with. Defaults to clients lent by `redditClient`.
+        workers (int, optional): Maximum number of submissions fetched at once.
+        stats (Counter, optional): Counts the number of `skipped` stories.
+        mode (str, optional): How the sentiment of each story is generated. See `storySentiment`.
+
     Returns:
         tuple: Meta data for a news story
     """
 
-    stories = []
-    subreddits = ['news', 'worldnews']
-    for subreddit in subreddits:
-        submissions = r.subreddit(subreddit).top(limit=100)
-        for item in tqdm(submissions):
-            sentiment = submission_sentiment(item.id)
-            print(sentiment)
-            stories.append((item.url, item.title, sentiment))
-        submissions = r.subreddit(subreddit).hot(limit=100)
-        for item in tqdm(submissions):
-            print(sentiment)
-            sentiment = submission_sentiment(item.id)
-            stories.append((item.url, item.title, sentiment))
-    for item in stories:
-        yield item
+    from tqdm import tqdm
+    new = submissions(reddit, stats)
+    # Without a client, each worker is lent one by `redditClient`
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sentiments = pool.map(lambda item: backoff(storySentiment, item.id, reddit, mode), new)
+        for item, sentiment in tqdm(zip(new, sentiments), total=len(new)):
+            yield (item.url, item.title, sentiment)
+
+
+@functools.lru_cache(maxsize=None)
+def tagger():
+
+    """Loads the part of speech tagger once per process.
+
+    Returns:
+        obj: The tagger used by `nltk.pos_tag`
+    """
+
+    from nltk.tag import PerceptronTagger
+    return PerceptronTagger()
+
+
+@functools.lru_cache(maxsize=None)
+def parser():
+
+    """Compiles the chunking grammar once per process.
+
+    Returns:
+        obj: Parser that chunks proper noun phrases
+    """
+
+    from nltk import RegexpParser
+    # Chunking pattern
+    chunkToExtract = """
+    NP: {<NNP>*}"""
+    # Create the new parser
+    return RegexpParser(chunkToExtract)
 
 
 def prepareForNLP(text):
@@ -87,12 +420,13 @@ def prepareForNLP(text):
         list: The tokenized and POS tagged `text`
     """
 
+    import nltk
     # Split up the input into sentences
     sentences = nltk.sent_tokenize(text)
     # Split up the sentences into words
     sentences = [nltk.word_tokenize(sent) for sent in sentences]
     # Tokenize the words
-    sentences = [nltk.pos_tag(sent) for sent in sentences]
+    sentences = [tagger().tag(sent) for sent in sentences]
     # Return the split and tokenized sentences
     return sentences
 
@@ -108,13 +442,8 @@ def chunk(sentence):
         str: Entity in the input sentence
     """
 
-    # Chunking pattern
-    chunkToExtract = """
-    NP: {<NNP>*}"""
-    # Create the new parser
-    parser = nltk.RegexpParser(chunkToExtract)
     # Parse the text
-    result = parser.parse(sentence)
+    result = parser().parse(sentence)
     # Yield the proper noun phrases
     for subtree in result.subtrees():
         if subtree.label() == 'NP':
@@ -140,71 +469,507 @@ def keywords(text):
             yield kw
 
 
-def makeEdges(nodes, story):
+def _startWorker():
 
-    """Generate the edges on the graph.
+    """Ignores the signals that ask a keyword extraction process to stop
+
+    A signal sent to the whole process group, as service managers do, would otherwise kill
+    the worker mid-task and leave the parent waiting forever for the result. The parent
+    handles the signal and closes the pool once it has finished. The tagger and parser are
+    loaded by the first text the worker is sent, so that an error loading them is raised to
+    the caller rather than the pool restarting the worker forever.
+    """
+
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _stopPool(pool):
+
+    """Lets the workers of a pool finish their tasks and waits for them to exit
+
+    `Pool.terminate` can't be used, as the workers ignore SIGTERM.
 
     Args:
-        nodes (list): List of Node objects generated by `addStory`
-        story (list): List of Story objects generated by `addStory`
+        pool (obj): The `multiprocessing.Pool`
+    """
+
+    pool.close()
+    pool.join()
+
+
+def _keywordList(text):
+
+    """Lists the key entities of `text` in a worker process.
+
+    Args:
+        text (str): The text that the keywords shall be extracted from.
+
+    Returns:
+        list: Entities from `text`
+    """
+
+    return list(keywords(text))
+
+
+@functools.lru_cache(maxsize=None)
+def getPool():
+
+    """Starts the pool of keyword extraction processes the first time it is needed.
+
+    There is a process for each CPU, and each loads the tagger and parser once. The pool is
+    kept until this process exits, so they aren't loaded again by later ingestion runs.
+
+    Returns:
+        obj: The `multiprocessing.Pool`
+    """
+
+    pool = multiprocessing.Pool(os.cpu_count() or 1, initializer=_startWorker)
+    atexit.register(_stopPool, pool)
+    return pool
+
+
+def keywords_batch(texts, processes=None, chunksize=CHUNKSIZE):
+
+    """Extracts the key entities of many texts using a pool of processes.
+
+    Each worker loads the tagger and compiles the grammar with its first text, and is
+    sent the texts `chunksize` at a time.
+
+    Args:
+        texts (list): The texts that the keywords shall be extracted from.
+        processes (int, optional): Number of worker processes. Defaults to the processes of `getPool()`.
+            With 1 the texts are processed in the calling process.
+        chunksize (int, optional): Number of texts sent to a worker at once.
+
+    Returns:
+        list: The entities of each text, in the order of `texts`
+    """
+
+    if processes == 1:
+        return [_keywordList(text) for text in texts]
+    if processes is None:
+        return getPool().map(_keywordList, texts, chunksize)
+    pool = multiprocessing.Pool(processes, initializer=_startWorker)
+    try:
+        return pool.map(_keywordList, texts, chunksize)
+    finally:
+        _stopPool(pool)
+
+
+def cleanKeywords(text):
+
+    """Extracts the keywords of `text` with their punctuation removed.
+
+    Args:
+        text (str): The text that the keywords shall be extracted from.
+
+    Returns:
+        list: Keywords ready to be resolved
+    """
+
+    return clean(keywords(text))
+
+
+def clean(kws):
+
+    """Removes the punctuation from keywords.
+
+    Args:
+        kws (list): Keywords as they were chunked from a text.
+
+    Returns:
+        list: Keywords ready to be resolved
+    """
+
+    return [kw.translate(str.maketrans('', '', string.punctuation)) for kw in kws]
+
+
+def lookup(kw, wikipedia=None):
+
+    """Asks Wikipedia for the heading of the article that `kw` refers to, bypassing the cache.
+
+    Args:
+        kw (str): Keyword as it was chunked from a story.
+        wikipedia (obj, optional): Object used to interact with the Wikipedia API. Defaults to `getWiki()`.
+
+    Returns:
+        str: Heading of the article. `None` if there is no article about `kw`
+    """
+
+    wikipedia = wikipedia or getWiki()
+    results = wikipedia.find(kw)
+    return wikipedia.get_article(results[0]).heading if len(results) > 0 else None
+
+
+def resolve(kw, wikipedia=None):
+
+    """Find the heading of the Wikipedia article that `kw` refers to.
+
+    Lookups are cached in the `Alias` table, so Wikipedia is only asked again once the cached entry has expired.
+
+    Args:
+        kw (str): Keyword as it was chunked from a story.
+        wikipedia (obj, optional): Object used to interact with the Wikipedia API. Defaults to `getWiki()`.
+
+    Returns:
+        str: Heading of the article. `None` if there is no article about `kw`
     """
 
-    while True:
-        if len(nodes) > 0:
-            node = nodes[0]
-            nodes.remove(node)
-            for i in nodes:
-                edge = Edge(source=story, origin=node, destination=i)
-                edge.save()
+    return resolveAll([kw], wikipedia, workers=1)[kw]
+
+
+def resolveAll(kws, wikipedia=None, workers=WORKERS):
+
+    """Find the headings of the Wikipedia articles that each of `kws` refers to.
+
+    Each distinct keyword is only resolved once. Cached keywords are looked up in bulk
+    and the rest are looked up on Wikipedia by a pool of `workers` threads.
+
+    Args:
+        kws (list): Keywords as they were chunked from stories.
+        wikipedia (obj, optional): Object used to interact with the Wikipedia API. Defaults to `getWiki()`.
+        workers (int, optional): Maximum number of keywords looked up on Wikipedia at once.
+
+    Returns:
+        dict: Heading of the article for each keyword. `None` if there is no article about it
+    """
+
+    cache = AliasCache(kws)
+    headings = cache.resolve(kws, wikipedia, workers)
+    cache.save()
+    return headings
+
+
+class AliasCache(object):
+
+    """In memory copy of the `Alias` table.
+
+    Keywords are resolved against the copy, and only the keywords that had to be
+    looked up on Wikipedia are written back by `save`. Safe to share between threads,
+    and between ingestion runs as entries still expire. A keyword that another thread
+    is already looking up waits for that lookup rather than making its own.
+
+    Attributes:
+        expires (dict): When each cached keyword should be looked up again
+        headings (dict): Heading of the article for each cached keyword. `None` if there is no article about it
+        inflight (dict): Future of the heading of each keyword being looked up on Wikipedia
+        pending (dict): Headings looked up on Wikipedia that haven't been saved yet
+    """
+
+    def __init__(self, kws=None):
+
+        """Load the cached keywords that haven't expired
+
+        Args:
+            kws (list, optional): Only load these keywords. Loads every keyword if not given.
+        """
+
+        self.headings = {}
+        self.expires = {}
+        self.pending = {}
+        self.inflight = {}
+        self._lock = threading.Lock()
+        if kws is None:
+            aliases = Alias.objects.all().iterator()
         else:
-            break
+            kws = list(set(kws))
+            # Keep well under the SQL variable limit of SQLite
+            aliases = itertools.chain.from_iterable(Alias.objects.filter(keyword__in=kws[i:i + 500])
+                                                    for i in range(0, len(kws), 500))
+        for alias in aliases:
+            if not alias.expired():
+                self.headings[alias.keyword] = alias.heading
+                self.expires[alias.keyword] = alias.date + alias.ttl()
+
+    def resolve(self, kws, wikipedia=None, workers=1):
+
+        """Find the headings of the Wikipedia articles that each of `kws` refers to.
+
+        Args:
+            kws (list): Keywords as they were chunked from stories.
+            wikipedia (obj, optional): Object used to interact with the Wikipedia API. Defaults to `getWiki()`.
+            workers (int, optional): Maximum number of keywords looked up on Wikipedia at once.
+
+        Returns:
+            dict: Heading of the article for each keyword. `None` if there is no article about it
+        """
+
+        kws = set(kws)
+        now = timezone.now()
+        with self._lock:
+            headings = {kw: self.headings[kw] for kw in kws if kw in self.headings and self.expires[kw] > now}
+            waiting = {kw: self.inflight[kw] for kw in kws if kw not in headings and kw in self.inflight}
+            missing = [kw for kw in kws if kw not in headings and kw not in waiting]
+            owned = {kw: Future() for kw in missing}
+            self.inflight.update(owned)
+        with _cache_stats_lock:
+            cache_stats['hits'] += len(headings) + len(waiting)
+            cache_stats['misses'] += len(missing)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                found = dict(zip(missing, pool.map(lambda kw: lookup(kw, wikipedia), missing)))
+        except BaseException as error:
+            with self._lock:
+                for kw in missing:
+                    del self.inflight[kw]
+            for future in owned.values():
+                future.set_exception(error)
+            raise
+        with self._lock:
+            self.headings.update(found)
+            self.expires.update((kw, now + Alias(heading=heading).ttl()) for kw, heading in found.items())
+            self.pending.update(found)
+            for kw in missing:
+                del self.inflight[kw]
+        for kw, future in owned.items():
+            future.set_result(found[kw])
+        headings.update(found)
+        headings.update((kw, future.result()) for kw, future in waiting.items())
+        return headings
+
+    def save(self):
+
+        """Writes the headings looked up on Wikipedia to the `Alias` table
+        """
+
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        for kw, heading in pending.items():
+            Alias.objects.update_or_create(keyword=kw, defaults={'heading': heading, 'date': timezone.now()})
+
+
+class NodeRegistry(object):
+
+    """Maps the names of nodes to their IDs for the length of an ingestion run.
+
+    Nodes that are seen during the run have their dates refreshed together by `flush`.
+
+    Attributes:
+        ids (dict): ID of each known node, by name
+        seen (set): IDs of the nodes seen since the last `flush`
+    """
+
+    def __init__(self, names=None):
+
+        """Load the known nodes from the database
+
+        Args:
+            names (list, optional): Only load the nodes with these names. Loads every node if not given.
+        """
+
+        if names is None:
+            self.ids = dict(Node.objects.values_list('name', 'id'))
+        else:
+            names = list(set(names))
+            self.ids = {}
+            # Keep well under the SQL variable limit of SQLite
+            for i in range(0, len(names), 500):
+                self.ids.update(Node.objects.filter(name__in=names[i:i + 500]).values_list('name', 'id'))
+        self.seen = set()
+
+    def get(self, names, story):
+
+        """Returns the IDs of the nodes called `names`, creating the nodes that don't exist yet.
+
+        Args:
+            names (list): Names of the nodes.
+            story (obj): The `Story` that new nodes are collected from.
+
+        Returns:
+            list: ID of each node in `names`
+        """
+
+        missing = set(name for name in names if name not in self.ids)
+        if len(missing) > 0:
+            Node.objects.bulk_create(Node(name=name, date=timezone.now(), collectedFrom=story) for name in missing)
+            self.ids.update(Node.objects.filter(name__in=missing).values_list('name', 'id'))
+        ids = [self.ids[name] for name in names]
+        self.seen.update(ids)
+        return ids
 
+    def flush(self):
 
-def addStory(story):
+        """Updates the dates of the nodes seen since the last flush
+        """
+
+        seen = list(self.seen)
+        now = timezone.now()
+        # Keep well under the SQL variable limit of SQLite
+        for i in range(0, len(seen), 500):
+            Node.objects.filter(id__in=seen[i:i + 500]).update(date=now)
+        self.seen = set()
+
+
+def makeEdges(nodes, story):
+
+    """Generate the edges on the graph.
+
+    Every pair of `nodes` is linked. Pairs that are already linked have the weight of their edge
+    increased, and the rest are inserted together. `nodes` is left unchanged.
+
+    Args:
+        nodes (list): List of Node objects generated by `addStory`, or their IDs
+        story (list): List of Story objects generated by `addStory`
+    """
+
+    nodes = [getattr(node, 'pk', node) for node in nodes]
+    # Edges always point from the lower ID to the higher one
+    pairs = set((min(a, b), max(a, b)) for a, b in itertools.combinations(nodes, 2) if a != b)
+    if len(pairs) == 0:
+        return
+    now = timezone.now()
+    existing = {}
+    candidates = Edge.objects.filter(origin__in=set(pair[0] for pair in pairs),
+                                     destination__in=set(pair[1] for pair in pairs))
+    for pk, origin, destination in candidates.values_list('pk', 'origin', 'destination'):
+        if (origin, destination) in pairs:
+            existing[(origin, destination)] = pk
+    if len(existing) > 0:
+        Edge.objects.filter(pk__in=existing.values()).update(weight=F('weight') + 1, lastSeen=now, source=story)
+    Edge.objects.bulk_create(Edge(source=story, origin_id=origin, destination_id=destination, date=now, lastSeen=now)
+                             for origin, destination in pairs if (origin, destination) not in existing)
+
+
+def addStory(story, wikipedia=None, headings=None, registry=None):
 
     """Adds a news story to the database.
 
     Args:
         story (tuple): The meta data of the story to be added.
+        wikipedia (obj, optional): Object used to interact with the Wikipedia API. Defaults to `getWiki()`.
+        headings (list, optional): The resolved keywords of `story`. Resolved here if they aren't given.
+        registry (obj, optional): `NodeRegistry` of the current run. The dates of the nodes are
+            only refreshed when it is flushed. Without one the dates are refreshed straight away.
     """
 
     print("Adding story:", story[0])
-    s = Story(source=story[0], content=story[1])
-    s.save()
-    nodes = []
-    for kw in keywords(story[1]):
-        kw = kw.translate(str.maketrans('', '', string.punctuation))
-        results = wiki.find(kw)
-        if len(results) > 0:
-            kw = wiki.get_article(results[0]).heading
-            if len(Node.objects.filter(name=kw)) < 1:
-                node = Node(name=kw, date=timezone.now(), collectedFrom=s)
-                node.save()
-            else:
-                node = Node.objects.filter(name=kw)[0]
-                node.date = timezone.now()
-            node_sentiment = Sentiment(sentiment=story[2], node=node)
-            node_sentiment.save()
-            nodes.append(node)
-    makeEdges(nodes, story[0])
+    if headings is None:
+        headings = [resolve(kw, wikipedia) for kw in cleanKeywords(story[1])]
+    names = [kw for kw in headings if kw is not None]
+    with transaction.atomic():
+        s = Story(source=story[0], content=story[1])
+        s.save()
+        run = registry or NodeRegistry(names)
+        nodes = run.get(names, s)
+        Sentiment.objects.bulk_create(Sentiment(sentiment=story[2], node_id=node) for node in nodes)
+        if story[2] is not None:
+            # Keep the totals on each node in step with its sentiments
+            occurrences = Counter(nodes)
+            for times in set(occurrences.values()):
+                ids = [node for node, n in occurrences.items() if n == times]
+                Node.objects.filter(id__in=ids).update(sentimentCount=F('sentimentCount') + times,
+                                                       sentimentSum=F('sentimentSum') + times * story[2],
+                                                       sentimentUpdated=timezone.now())
+        makeEdges(nodes, story[0])
+        if registry is None:
+            run.flush()
+
+
+def addStories(stories, wikipedia=None, workers=WORKERS, registry=None, processes=None):
+
+    """Adds a batch of news stories to the database.
+
+    The keywords of every story are extracted first, spread over a pool of processes,
+    so that keywords shared between stories are only resolved once.
+
+    Args:
+        stories (list): The meta data of the stories to be added.
+        wikipedia (obj, optional): Object used to interact with the Wikipedia API. Defaults to `getWiki()`.
+        workers (int, optional): Maximum number of keywords looked up on Wikipedia at once.
+        registry (obj, optional): `NodeRegistry` of the current run.
+        processes (int, optional): Number of processes the keywords are extracted by. Defaults to the number of CPUs.
+    """
 
+    story_keywords = [clean(kws) for kws in keywords_batch([story[1] for story in stories], processes)]
+    headings = resolveAll([kw for kws in story_keywords for kw in kws], wikipedia, workers)
+    for story, kws in zip(stories, story_keywords):
+        addStory(story, headings=[headings[kw] for kw in kws], registry=registry)
 
-def updateDB():
+
+@contextlib.contextmanager
+def lock(path=None):
+
+    """Stops more than one ingestion run happening at once, even from different processes.
+
+    Args:
+        path (str, optional): File that is locked for the length of the run. Defaults to `settings.INGEST_LOCK`.
+
+    Returns:
+        bool: Was the lock acquired? If not another run is in progress
+    """
+
+    with open(path or settings.INGEST_LOCK, 'a') as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def updateDB(reddit=None, wikipedia=None, workers=STAGE_WORKERS, cache=None, mode='top'):
 
     """Updates the DB to a more recent version of the news
+
+    New stories flow through a pipeline of stages that run at the same time. Their comments
+    are scored, their keywords extracted by the processes of `getPool()` and then resolved on
+    Wikipedia, before they are written to the database from the calling thread.
+
+    Args:
+        reddit (obj, optional): Reddit client to fetch the stories with. Defaults to clients lent by `redditClient`.
+        wikipedia (obj, optional): Object used to interact with the Wikipedia API. Defaults to `getWiki()`.
+        workers (dict, optional): Number of worker threads for each stage.
+        cache (obj, optional): `AliasCache` kept from a previous run. Loaded from the database if not given.
+        mode (str, optional): How the sentiment of each story is generated. See `storySentiment`.
     """
 
-    # For each story currently on the BBC RSS feed
-    for story in stories():
-        # More than 0 if the story is in the DB
-        matches = Story.objects.filter(source=story[0])
-        # If the story isn't in the database
-        if len(matches) == 0:
-            addStory(story)
-        else:
-            pass
+    # Imported here as they load NumPy, which importing updateDB shouldn't
+    from relationships import graph, layout
+
+    stats = Counter()
+    cache = cache or AliasCache()
+    registry = NodeRegistry()
+    # Started before the stages so that no other threads are running when it forks
+    nlp = getPool()
+
+    def score(item):
+        return (item.url, item.title, backoff(storySentiment, item.id, reddit, mode))
+
+    def extract(story):
+        return (story, clean(nlp.apply(_keywordList, (story[1],))))
+
+    def resolveStory(item):
+        headings = cache.resolve(item[1], wikipedia)
+        return (item[0], [headings[kw] for kw in item[1]])
+
+    def write(item):
+        addStory(item[0], headings=item[1], registry=registry)
+
+    stages = [pipeline.Stage('sentiment', score, workers['sentiment']),
+              pipeline.Stage('keywords', extract, workers['keywords']),
+              pipeline.Stage('resolve', resolveStory, workers['resolve']),
+              pipeline.Stage('write', write, 0)]
+    # `submissions` only lists stories that aren't in the database yet
+    pipeline.run(stages, submissions(reddit, stats))
+    cache.save()
+    registry.flush()
+    layout.update()
+    snapshot = graph.publish()
+    for stage in stages:
+        print(stage)
+    print("Skipped fetching", stats['skipped'], "stories already in the DB")
+    print("Keyword cache:", cache_stats['hits'], "hits,", cache_stats['misses'], "misses")
+    print("Published version", snapshot.version(), "of the graph")
 
 
 if __name__ == "__main__":
     print("Updating DB")
-    updateDB()
+    with lock() as acquired:
+        if acquired:
+            updateDB()
+        else:
+            print("Another update is already running")